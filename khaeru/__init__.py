@@ -6,8 +6,41 @@ import click
 repo_path = Path(__file__).parents[1]
 scripts_path = Path(__file__).parent.joinpath("script")
 
+# Console scripts without a --help option; see startup()
+NO_HELP = {"ceic", "strip-replies", "task-notify"}
 
-@click.group(help=str(repo_path))
+
+class LazyGroup(click.Group):
+    """Group with subcommands that are only imported when used.
+
+    `lazy` maps command names to "module.attribute", relative to :mod:`khaeru`.
+    """
+
+    def __init__(self, *args, lazy=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy = lazy or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy and cmd_name not in self.commands:
+            mod_name, attr = self.lazy[cmd_name].rsplit(".", maxsplit=1)
+            module = import_module(f"khaeru.{mod_name}")
+            self.add_command(getattr(module, attr), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+
+@click.group(
+    cls=LazyGroup,
+    help=str(repo_path),
+    lazy={
+        "bugwarrior-gen-config": "bugwarrior.main",
+        "music": "music.cli",
+        "obsidian": "obsidian.main",
+        "prep-release": "prep_release.main",
+    },
+)
 def cli():
     pass
 
@@ -16,22 +49,96 @@ _help = f"""Invoke a script from {repo_path}.
 
 If the first of ARG is a script in {scripts_path}, it is invoked, with the remaining
 ARGS passed.
+
+With --jobs, each line of JOBS gives a script and its arguments, e.g. "gpg-edit
+FILE". Blank lines and lines starting with "#" are ignored. Up to N jobs are run
+at once; their output is shown with a prefix identifying the job, followed by the
+exit status and duration of each job. The exit status is non-zero if any job
+failed.
 """
 
 
-@cli.command(help=_help)
-@click.argument("args", nargs=-1)
-def run(args):
+def _script(args):
+    """Return the command line for the script named by the first of `args`."""
+    script_file = scripts_path.joinpath(f"{args[0]}.sh")
+
+    if not script_file.exists():
+        raise click.ClickException(f"No script {script_file}\n")
+
+    return [str(script_file)] + list(args[1:])
+
+
+def _run_job(prefix, cmd, lock):
+    """Run `cmd`, echoing its output with `prefix`; return the status and duration.
+
+    If `cmd` cannot be started, the status is 127 if it was not found, else 126, as
+    in the shell.
+    """
+    from subprocess import PIPE, STDOUT, Popen
+    from time import perf_counter
+
+    start = perf_counter()
+    try:
+        p = Popen(cmd, stdout=PIPE, stderr=STDOUT, text=True, errors="replace")
+    except OSError as e:
+        with lock:
+            click.echo(f"{prefix} {e}")
+        return 127 if isinstance(e, FileNotFoundError) else 126, 0.0
+
+    with p:
+        for line in p.stdout:
+            with lock:
+                click.echo(f"{prefix} {line}", nl=False)
+    return p.returncode, perf_counter() - start
+
+
+@cli.command(help=_help, context_settings=dict(allow_interspersed_args=False))
+@click.option(
+    "-f", "--jobs", "jobs_file", type=click.File(), metavar="JOBS", help="File of jobs."
+)
+@click.option(
+    "-p",
+    "--parallel",
+    type=click.IntRange(min=1),
+    default=1,
+    metavar="N",
+    help="Jobs to run at once.",
+)
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def run(jobs_file, parallel, args):
+    from concurrent.futures import ThreadPoolExecutor
+    from shlex import split
     from subprocess import run
+    from threading import Lock
 
-    args = list(args)
+    if jobs_file is None:
+        if not args:
+            raise click.UsageError("Give a script name or --jobs")
+        # Run a single script directly, with its exit status
+        raise SystemExit(run(_script(args)).returncode)
 
-    script_file = scripts_path.joinpath(f"{args.pop(0)}.sh")
+    elif args:
+        raise click.UsageError("Give either a script name or --jobs, not both")
 
-    if not script_file.exists():
-        raise click.ClickException(f"No script {script_file}\n")
+    jobs = [split(line) for line in jobs_file]
+    jobs = [_script(job) for job in jobs if job and not job[0].startswith("#")]
 
-    run([str(script_file)] + args)
+    lock = Lock()
+    with ThreadPoolExecutor(parallel) as pool:
+        futures = []
+        for i, cmd in enumerate(jobs):
+            prefix = f"[{i} {Path(cmd[0]).stem}]"
+            futures.append((prefix, pool.submit(_run_job, prefix, cmd, lock)))
+        results = [(prefix, future.result()) for prefix, future in futures]
+
+    failed = 0
+    click.echo("\nStatus  Time (s)  Job", err=True)
+    for prefix, (status, duration) in results:
+        click.echo(f"{status:6d}  {duration:8.1f}  {prefix}", err=True)
+        failed += status != 0
+
+    if failed:
+        raise click.ClickException(f"{failed} of {len(jobs)} jobs failed")
 
 
 @cli.command()
@@ -49,12 +156,119 @@ def deps(name):
         raise click.ClickException(f"No submodule/dependencies for {name}")
 
 
-for name in (
-    "bugwarrior.main",
-    "music.cli",
-    "obsidian.main",
-    "prep_release.main",
-):
-    mod_name, cmd_name = name.rsplit(".", maxsplit=1)
-    module = import_module(f"khaeru.{mod_name}")
-    cli.add_command(getattr(module, cmd_name))
+@cli.command("benchmark", hidden=True)
+@click.argument("module", type=click.Choice(["dedupe", "maildupe"]))
+@click.option("-N", "N", type=int, help="Paths per group; default depends on MODULE.")
+@click.option("--repeat", type=int, default=5, help="Runs per group.")
+def benchmark(module, N, repeat):
+    """Time the current code in MODULE against the code it replaced.
+
+    MODULE.benchmark() returns the former and current functions, and a dict of named
+    synthetic groups of paths to pass to each.
+    """
+    from timeit import timeit
+
+    kwargs = {} if N is None else dict(N=N)
+    former, current, groups = import_module(f"khaeru.{module}").benchmark(**kwargs)
+
+    for name, paths in groups.items():
+        t0 = timeit(lambda: former(paths), number=repeat) / repeat
+        t1 = timeit(lambda: current(paths), number=repeat) / repeat
+        print(
+            f"{name}, {len(paths)} paths: {1e3 * t0:.2f} ms → {1e3 * t1:.2f} ms "
+            f"({t0 / t1:.1f}×)"
+        )
+
+
+@cli.command("import-time", hidden=True)
+@click.argument("module", default="khaeru")
+@click.option("--top", type=int, default=10, help="Number of modules to show.")
+def import_time(module, top):
+    """Show the time to import MODULE, from 'python -X importtime'."""
+    from subprocess import run
+    import sys
+
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    lines = run(cmd, capture_output=True, text=True, check=True).stderr.splitlines()
+
+    # Lines are "import time: SELF | CUMULATIVE | NAME", in microseconds; NAME is
+    # indented according to the depth of the import
+    times = []
+    for line in lines[1:]:
+        _, cumulative, name = line.partition(":")[2].split("|")
+        times.append((int(cumulative), name.rstrip()))
+
+    # Cumulative time of MODULE itself, excluding interpreter start-up imports
+    total = next((t for t, name in times if name.strip() == module), None)
+    if total is None:
+        raise click.ClickException(f"{module} not found in 'python -X importtime'")
+    print(f"import {module}: {total / 1e3:.1f} ms")
+    for cumulative, name in sorted(times, reverse=True)[:top]:
+        print(f"{cumulative / 1e3:8.1f} ms {name}")
+
+
+@cli.command("startup", hidden=True)
+@click.argument("scripts", nargs=-1)
+@click.option("--repeat", type=int, default=10, help="Runs per script.")
+def startup(scripts, repeat):
+    """Time the startup of console SCRIPTS; default all.
+
+    Each entry point in pyproject.toml is run with --help in a new interpreter. The
+    fastest of REPEAT runs, minus the fastest of REPEAT runs of "python -c pass", is
+    compared to its budget, in milliseconds, from [tool.khaeru.startup]. Scripts with
+    no --help are only imported. Exits with an error if any script fails or exceeds
+    its budget.
+    """
+    from subprocess import DEVNULL, run
+    import sys
+    from time import perf_counter
+    import tomllib
+
+    try:
+        config = tomllib.loads(repo_path.joinpath("pyproject.toml").read_text())
+    except FileNotFoundError:
+        raise click.ClickException(
+            f"No pyproject.toml in {repo_path}; run from a source checkout"
+        )
+    entry_points = config["project"]["scripts"]
+    budget = config["tool"].get("khaeru", {}).get("startup", {})
+
+    def fastest(*cmds):
+        """Return the fastest of `repeat` runs of each of `cmds`, in ms, and the exit
+        status of the last.
+
+        Runs of the different `cmds` alternate, so that changes in the load of the
+        machine affect all of them alike.
+        """
+        times = [[] for _ in cmds]
+        for _ in range(repeat):
+            for cmd, t in zip(cmds, times):
+                start = perf_counter()
+                result = run(cmd, stdout=DEVNULL, stderr=DEVNULL)
+                t.append(1e3 * (perf_counter() - start))
+        return [min(t) for t in times], result.returncode
+
+    failed = []
+    for name in scripts or entry_points:
+        mod_name, attr = entry_points[name].split(":")
+        code = f"from {mod_name} import {attr}"
+        if name not in NO_HELP:
+            code += f"; {attr}()"
+
+        (base, time), returncode = fastest(
+            [sys.executable, "-c", "pass"], [sys.executable, "-c", code, "--help"]
+        )
+        extra = time - base
+
+        if returncode:
+            status = f"error (exit status {returncode})"
+        elif extra > budget.get(name, float("inf")):
+            status = f"over budget of {budget[name]} ms"
+        else:
+            status = "ok"
+        print(f"{name:>15}: {extra:6.1f} ms over {base:5.1f} ms  {status}")
+        if status != "ok":
+            failed.append(name)
+
+    if failed:
+        raise click.ClickException(f"Startup too slow or failed: {' '.join(failed)}")
@@ -8,7 +8,6 @@ import subprocess
 
 import click
 from packaging.version import parse
-import requests
 
 
 NO_VERSION = parse("0.0.0")
@@ -52,6 +51,8 @@ def pip_list():
 
 
 def pip_search(name):
+    import requests
+
     candidate = None
 
     # cf. https://github.com/pipxproject/pipx/issues/149#issuecomment-491568667
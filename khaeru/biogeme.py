@@ -1,13 +1,27 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from copy import deepcopy
+from hashlib import sha256
+from io import StringIO
+import os
+from pathlib import Path
+import pickle
+import sqlite3
 from subprocess import Popen
+from tempfile import TemporaryDirectory, mkdtemp
 from re import compile
 from types import SimpleNamespace
+from warnings import warn
 
+import numpy as np
 import pandas as pd
+from scipy.optimize import minimize
 from scipy.stats import chi2
+from xdg_base_dirs import xdg_cache_home
 
 
-__all__ = ['Model', 'lr_test']
+__all__ = ['DataStore', 'DesignMatrix', 'Model', 'ResultCache', 'estimate_all',
+           'lr_test']
 
 # Valid model types
 MODEL_TYPES = ['BP', 'CNL', 'MNL', 'NGEV', 'NL', 'OL']
@@ -29,6 +43,9 @@ REGEX = {
     }
 REGEX = {key: compile(expr) for key, expr in REGEX.items()}
 
+# Default location of the ResultCache
+CACHE = xdg_cache_home().joinpath('khaeru', 'biogeme.sqlite')
+
 # Unsupported sections of .mod and .res files, for Model._read_mod()
 SKIP = [
     # These sections contain only "$NONE" in the .res file. Omitting them from
@@ -65,6 +82,332 @@ SKIP = [
     ]
 
 
+class DesignMatrix:
+    """Sparse boolean design matrix: alternatives × coefficients × variables.
+
+    An entry is True if the utility of the alternative contains the term
+    "coefficient * variable". Only the (integer) coordinates of True entries
+    are stored, so adding labels or entries takes amortized constant time.
+    Entries are set and read using labels, e.g. ``D[choice, beta, var] = True``.
+
+    """
+    def __init__(self, choices, betas=(), variables=()):
+        # Labels, and label : position, for each axis
+        self._labels = ([], [], [])
+        self._index = ({}, {}, {})
+        # (alternative, coefficient, variable) positions of True entries
+        self._entries = set()
+
+        for axis, labels in enumerate([choices, betas, variables]):
+            for label in labels:
+                self._add(axis, label)
+
+    def _add(self, axis, label):
+        if label not in self._index[axis]:
+            self._index[axis][label] = len(self._labels[axis])
+            self._labels[axis].append(label)
+
+    def _key(self, key):
+        return tuple(index[label] for index, label in zip(self._index, key))
+
+    def add_beta(self, name):
+        """Add a coefficient *name*, if it does not exist."""
+        self._add(1, name)
+
+    def add_variable(self, name):
+        """Add a variable *name*, if it does not exist."""
+        self._add(2, name)
+
+    def drop_beta(self, name):
+        """Remove the coefficient *name* and its entries."""
+        j = self._index[1].pop(name)
+        self._entries = {e for e in self._entries if e[1] != j}
+
+    @property
+    def betas(self):
+        """Coefficient labels, in the order they were added."""
+        return list(self._index[1])
+
+    def __getitem__(self, key):
+        return self._key(key) in self._entries
+
+    def __setitem__(self, key, value):
+        key = self._key(key)
+        if value:
+            self._entries.add(key)
+        else:
+            self._entries.discard(key)
+
+    def items(self):
+        """Return a list of (alternative, coefficient, variable) of entries.
+
+        Entries are sorted by the order in which labels were added to each axis.
+        """
+        return [tuple(labels[p] for labels, p in zip(self._labels, e))
+                for e in sorted(self._entries)]
+
+    def terms(self, choice):
+        """Return a list of (coefficient, variable) in the utility of *choice*.
+
+        Terms are in the order in which the variables were added.
+        """
+        i = self._index[0][choice]
+        return [(self._labels[1][j], self._labels[2][k]) for _, k, j in
+                sorted((e[0], e[2], e[1]) for e in self._entries if e[0] == i)]
+
+
+class DataStore:
+    """Immutable, memory-mapped store of the columns of a Biogeme data file.
+
+    Each column of the data file *path* is converted once to a .npy file in the
+    directory "*path*.npy", which is rebuilt if *path* changes. The columns are
+    memory-mapped read-only, so that all Models using the same data file share
+    one copy of the data in memory. Use DataStore.get() to obtain the store
+    for a given *path*.
+
+    """
+    _stores = {}  # absolute path : DataStore
+
+    def __init__(self, path, chunk_size=100000):
+        self.path = path
+        self.dir = path + '.npy'
+        stat = os.stat(path)
+        self.source = '{} {}'.format(stat.st_size, stat.st_mtime_ns)
+
+        try:
+            with open(os.path.join(self.dir, 'source')) as f:
+                current = f.read() == self.source
+        except OSError:
+            current = False
+        if not current:
+            self._convert(chunk_size)
+
+        with open(os.path.join(self.dir, 'columns')) as f:
+            columns = f.read().splitlines()
+        self.data = pd.DataFrame({
+            name: np.load(self._column_fn(i), mmap_mode='r')
+            for i, name in enumerate(columns)}, copy=False)
+
+    @classmethod
+    def get(cls, path):
+        """Return the store for *path*, reusing one that is already open."""
+        path = os.path.abspath(path)
+        store = cls._stores.get(path)
+        stat = os.stat(path)
+        if (store is None or
+                store.source != '{} {}'.format(stat.st_size, stat.st_mtime_ns)):
+            store = cls._stores[path] = cls(path)
+        return store
+
+    def __reduce__(self):
+        # Unpickled or copied stores refer to the same files
+        return DataStore.get, (self.path,)
+
+    def _column_fn(self, i):
+        return os.path.join(self.dir, '%d.npy' % i)
+
+    def _convert(self, chunk_size):
+        """Convert the data file to .npy files, reading *chunk_size* rows at a
+        time.
+
+        Files are written under temporary names, then renamed, so that
+        existing memory maps of an older version remain valid.
+        """
+        os.makedirs(self.dir, exist_ok=True)
+
+        # First pass: count rows and determine the type of each column
+        rows = 0
+        dtypes = {}
+        for chunk in pd.read_table(self.path, chunksize=chunk_size):
+            rows += len(chunk)
+            for name, dtype in chunk.dtypes.items():
+                dtypes[name] = np.result_type(dtypes.get(name, dtype), dtype)
+        for name, dtype in dtypes.items():
+            if dtype.kind not in 'biuf':
+                raise ValueError("Non-numeric column '{}' in {}"
+                                 .format(name, self.path))
+
+        # Second pass: fill the columns
+        columns = [np.lib.format.open_memmap(self._column_fn(i) + '.tmp',
+                                             mode='w+', dtype=dtype,
+                                             shape=(rows,))
+                   for i, dtype in enumerate(dtypes.values())]
+        start = 0
+        for chunk in pd.read_table(self.path, chunksize=chunk_size):
+            end = start + len(chunk)
+            for column, (_, values) in zip(columns, chunk.items()):
+                column[start:end] = values.to_numpy()
+            start = end
+
+        for i, column in enumerate(columns):
+            column.flush()
+            os.replace(self._column_fn(i) + '.tmp', self._column_fn(i))
+        for name, content in (('columns', '\n'.join(dtypes)),
+                              ('source', self.source)):
+            with open(os.path.join(self.dir, name + '.tmp'), 'w') as f:
+                f.write(content)
+            os.replace(os.path.join(self.dir, name + '.tmp'),
+                       os.path.join(self.dir, name))
+
+
+def _normalize(text):
+    """Normalize the .mod file *text*, for ResultCache.key().
+
+    Comments, blank lines and repeated whitespace are removed. In the Beta
+    section, numbers are formatted consistently, and the starting values of
+    coefficients that are not fixed are replaced with "*", so that estimated
+    and unestimated models match.
+    """
+    lines = []
+    section = None
+    for line in text.splitlines():
+        fields = line.split('//')[0].split()
+        if len(fields) == 0:
+            continue
+        elif fields[0].startswith('['):
+            section = fields[0]
+        elif section == '[Beta]':
+            # Format numbers consistently
+            fields[1:4] = [repr(float(x)) for x in fields[1:4]]
+            if fields[-1] == '0':
+                fields[1] = '*'
+        lines.append(' '.join(fields))
+    return '\n'.join(lines)
+
+
+class ResultCache:
+    """On-disk SQLite cache of estimation results.
+
+    Entries are keyed by a hash of the normalized .mod text of a model, the
+    absolute path and a fingerprint (size and modification time) of the data
+    it is estimated on, and the estimation engine. Each entry stores the
+    stats, coefficients and standard errors of the model.
+
+    """
+    def __init__(self, path=CACHE):
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY '
+                        'KEY, result BLOB)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.db.close()
+
+    @staticmethod
+    def key(model, engine):
+        """Return the key for *model* estimated with *engine*.
+
+        For the numpy engine, returns None if the data of *model* differs from
+        its data file, e.g. after Model.add_data() or edits to Model.data; see
+        Model._shared_data.
+        """
+        if engine == 'numpy' and not model._shared_data:
+            return None
+        if engine == 'numpy':
+            # The data read by the model
+            path, fingerprint = model._store.path, model._store.source
+        else:
+            # The data file read by Biogeme
+            path = os.path.abspath(model._data_fn)
+            stat = os.stat(path)
+            fingerprint = '{} {}'.format(stat.st_size, stat.st_mtime_ns)
+        f = StringIO()
+        model.write(f)
+        h = sha256(_normalize(f.getvalue()).encode())
+        h.update('\0{}\0{}\0{}'.format(path, fingerprint, engine).encode())
+        return h.hexdigest()
+
+    def get(self, model, engine):
+        """Update *model* from the cache; return True if it was found."""
+        key = self.key(model, engine)
+        if key is None:
+            return False
+        row = self.db.execute('SELECT result FROM results WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            return False
+        model.stats, model._beta, model.std_err = pickle.loads(row[0])
+        return True
+
+    def put(self, model, engine):
+        """Store the results of *model*, estimated with *engine*.
+
+        Results that did not converge are not stored.
+        """
+        key = self.key(model, engine)
+        if key is None or model.converged is False:
+            return
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?)',
+                (key, pickle.dumps((model.stats, model._beta, model.std_err))))
+
+    def invalidate(self, model=None, engine='biogeme'):
+        """Remove the entry for *model* and *engine*, or all entries."""
+        with self.db:
+            if model is None:
+                self.db.execute('DELETE FROM results')
+            else:
+                self.db.execute('DELETE FROM results WHERE key = ?',
+                                (self.key(model, engine),))
+
+
+def _eval(expr, resolvers, n):
+    """Evaluate the Biogeme expression *expr* as an array of length *n*.
+
+    *expr* may be a number. Names in *expr* are looked up in *resolvers*.
+    """
+    if isinstance(expr, str):
+        expr = expr.replace('&&', '&').replace('||', '|')
+        expr = pd.eval(expr, resolvers=resolvers, engine='python')
+    return np.broadcast_to(np.asarray(expr, dtype=float), (n,))
+
+
+def _log_logit(V, avail):
+    """Return MNL log choice probabilities for utilities *V*.
+
+    The log-sum-exp is computed stably. Unavailable alternatives, where *avail*
+    is False, have log probability -inf.
+    """
+    V = np.where(avail, V, -np.inf)
+    V = V - V.max(axis=1, keepdims=True)
+    with np.errstate(divide='ignore'):
+        return V - np.log(np.exp(V).sum(axis=1, keepdims=True))
+
+
+def _mnl(beta, X, A, B, avail, Y):
+    """Return the MNL log likelihood, its gradient, and probabilities.
+
+    *X* contains the value of the variable in each utility term, for each row;
+    *A* and *B* are one-hot matrices of the alternative and coefficient of each
+    term. *Y* is one-hot for the chosen alternative in each row.
+    """
+    log_P = _log_logit((X * (B @ beta)) @ A, avail)
+    LL = log_P[Y].sum()
+    P = np.exp(log_P)
+    gradient = ((Y - P) @ A.T * X).sum(axis=0) @ B
+    return LL, gradient, P
+
+
+def _hessian(X, A, B, P, chunk_size=10000):
+    """Return the Hessian of the MNL log likelihood, given probabilities *P*.
+
+    Rows are processed in chunks of *chunk_size*, to limit memory use.
+    """
+    H = np.zeros((B.shape[1], B.shape[1]))
+    for start in range(0, len(X), chunk_size):
+        end = start + chunk_size
+        # Derivatives of utilities with respect to coefficients
+        Z = np.einsum('nt,ti,tj->nij', X[start:end], A, B)
+        Z -= np.einsum('ni,nij->nj', P[start:end], Z)[:, None, :]
+        H -= np.einsum('ni,nij,nik->jk', P[start:end], Z, Z)
+    return H
+
+
 def fn(model, ext):
     """Determine model file name."""
     if model.name is None:
@@ -76,6 +419,8 @@ class Model:
     """Simple class for a Biogeme model."""
     name = None  # A name for the model
     stats = None  # Statistics of the estimated model
+    std_err = None  # Standard errors of the coefficients, from _estimate()
+    converged = None  # False if _estimate() did not converge
     _available = {}  # choice alternative : availability variable
     _expressions = None  # name : expression string
     _exclude = None  # expression string
@@ -102,12 +447,15 @@ class Model:
         """
         self.name = name
         self.stats = SimpleNamespace()
+        self._available = {}
         self._expressions = {}
         self._generalized_utilities = {}  # choice: expression string
 
         # Read the list of variables
         self._data_fn = data_fn
-        self.data = pd.read_table(data_fn)
+        self._store = DataStore.get(data_fn)
+        # A frame of the model's own, over the shared, read-only columns
+        self.data = self._store.data.copy(deep=False)
         self._variables = self.data.columns.tolist()
 
         # Coefficients
@@ -126,6 +474,34 @@ class Model:
             for c in self.choices:
                 self.set_avail(c, avail_vars % c)
 
+    @property
+    def _shared_data(self):
+        """True if *data* is unmodified from the data file.
+
+        This is the case if *data* has the same rows and columns as the
+        DataStore, and each column is still its memory map. Columns written to
+        are copied by pandas, so edits to *data* are detected.
+        """
+        store = self._store.data
+        if not (self.data.columns.equals(store.columns) and
+                self.data.index.equals(store.index)):
+            return False
+        return all(np.shares_memory(self.data[c].to_numpy(),
+                                    store[c].to_numpy())
+                   for c in store.columns)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shared_data:
+            # Refer to the shared data, rather than copying or pickling it
+            state['data'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.data is None:
+            self.data = self._store.data.copy(deep=False)
+
     @property
     def model_type(self):
         return self._model_type
@@ -152,8 +528,8 @@ class Model:
         self._choice = value
         self.choices = sorted(self.data[value].unique())
         self._generalized_utilities = {c: None for c in self.choices}
-        self.D = pd.Panel(items=self.choices, minor_axis=self._variables,
-                          dtype=bool)
+        self.D = DesignMatrix(self.choices, self._beta.index,
+                              self._variables)
 
     def add_as(self, name_template, var_template):
         """Add alternative-specific coefficients to the model.
@@ -170,7 +546,7 @@ class Model:
                 ("Variable '{}' for alternative-specific coefficient '{}' not "
                  "found").format(var, name)
             self.add_beta(name)
-            self.D.loc[c, name, var] = True
+            self.D[c, name, var] = True
 
     def add_asconst(self, name_template='ASC%s', fixed='first'):
         """Add alternative-specific constants (ASC) to the model.
@@ -209,25 +585,20 @@ class Model:
             self.add_beta(name, fixed=((fixed == 'first' and i == 0) or
                                        (fixed == c)))
             # Coefficient times the attribute in the design matrix
-            self.D.loc[c, name, var] = True
+            self.D[c, name, var] = True
 
     def add_beta(self, name, value=0, lower=-100, upper=100, fixed=False):
         """Add a coefficient to the model."""
-        data = pd.Series(dict(value=value, lower=lower, upper=upper,
-                              fixed=fixed), name=name)
-        if name in self._beta.index:
-            # The coefficient already exists; replace its values
-            self._beta.loc[name, :] = data
-        else:
-            # Add the coefficient
-            self._beta = self._beta.append(data)
+        # Add the coefficient, or replace the values of an existing one
+        self._beta.loc[name] = [value, lower, upper, fixed]
+        if hasattr(self, 'D'):
             # Extend the design matrix to include the new coefficient
-            self.D = self.D.reindex_axis(self._beta.index, axis=1)
+            self.D.add_beta(name)
 
     def remove_beta(self, name):
         """Remove a coefficient from the model."""
         self._beta.drop(name, inplace=True)
-        self.D.drop(name, axis=1, inplace=True)
+        self.D.drop_beta(name)
 
     def add_data(self, new):
         """Add a data column to the model."""
@@ -235,7 +606,7 @@ class Model:
         self.data = pd.concat([self.data, new], axis=1)
         # Extend the design matrix to include the new variable
         self._variables.append(new.name)
-        self.D = self.D.reindex_axis(self._variables, axis=2)
+        self.D.add_variable(new.name)
 
     def add_expression(self, name, value):
         """Add an expression."""
@@ -244,7 +615,8 @@ class Model:
         self._expressions[name] = value
         # Extend the design matrix to include the new expression
         self._variables.append(name)
-        self.D = self.D.reindex_axis(self._variables, axis=2)
+        if hasattr(self, 'D'):
+            self.D.add_variable(name)
 
     def add_generic(self, name, var_template):
         """Add a generic coefficient, *name*, to the model.
@@ -259,7 +631,7 @@ class Model:
             assert var in self._variables, \
                 ("Variable '{}' for generic coefficient '{}' not found") \
                 .format(var, name)
-            self.D.loc[c, name, var] = True
+            self.D[c, name, var] = True
 
     def add_genutil(self, choice, expr):
         """Add a generalized utility."""
@@ -270,14 +642,28 @@ class Model:
             self._generalized_utilities[choice] += ' + ' + expr
 
     def copy(self, name=None, data_fn=None):
+        """Return a copy of the model.
+
+        If *name* is given, the copy has that name. If *data_fn* is given, the
+        copy uses the data in that file, which must contain all the variables
+        in the data of the model; for instance, a market segment.
+
+        """
         result = deepcopy(self)
         if name is not None:
             result.name = name
         if data_fn is not None:
+            store = DataStore.get(data_fn)
+            missing = set(self.data.columns) - set(store.data.columns)
+            if len(missing):
+                raise ValueError('Variables {} not in {}'
+                                 .format(sorted(missing), data_fn))
             result._data_fn = data_fn
+            result._store = store
+            result.data = store.data.copy(deep=False)
         return result
 
-    def estimate(self):
+    def estimate(self, engine='biogeme', cache=None):
         """Run the model.
 
         If *name* is given, the model is stored in "*name*.mod", and full
@@ -285,9 +671,130 @@ class Model:
         (default), the name attribute of the Model is used; and if neither is
         given, a ValueError is raised.
 
+        With *engine* 'numpy', MNL models are instead estimated in-process; see
+        _estimate().
+
+        If *cache* is a ResultCache, results are read from it if the model and
+        its data are unchanged; otherwise, new results are stored in it.
+
         """
-        self._run('biogeme')
-        self.read_results()
+        if cache is not None and cache.get(self, engine):
+            return
+        elif engine == 'numpy':
+            self._estimate()
+        else:
+            self._run('biogeme')
+            self.read_results()
+
+        if cache is not None:
+            cache.put(self, engine)
+
+    def _check_numpy(self, action):
+        """Raise ValueError if the model cannot be *action*-ed in-process."""
+        if self.model_type != 'MNL':
+            raise ValueError('In-process {} of {} models is not supported'
+                             .format(action, self.model_type))
+        elif any(gu is not None
+                 for gu in self._generalized_utilities.values()):
+            raise ValueError('In-process {} of models with generalized '
+                             'utilities is not supported'.format(action))
+
+    def _values(self):
+        """Return a function giving values of variables, and the rows used.
+
+        The function takes the name of a data column or expression, and returns
+        an array of its values for all rows. *rows* is a boolean array, False
+        for rows of the data excluded by *_exclude*.
+        """
+        n = len(self.data)
+        # Data columns, then expressions in the order they were added
+        env = {}
+        resolvers = (env, self.data)
+        for name, expr in self._expressions.items():
+            env[name] = _eval(expr, resolvers, n)
+
+        def values(name):
+            return env[name] if name in env else self.data[name].to_numpy(float)
+
+        rows = np.ones(n, dtype=bool)
+        if self._exclude is not None:
+            rows = _eval(self._exclude, resolvers, n) == 0
+
+        return values, rows
+
+    def _arrays(self):
+        """Return arrays of the data for in-process estimation.
+
+        Returns (X, A, B, avail, rows): see _mnl() for the first three. *avail*
+        is a boolean array of rows × alternatives. For *rows*, see _values().
+        """
+        values, rows = self._values()
+        terms = self.D.items()
+        index = {b: j for j, b in enumerate(self._beta.index)}
+
+        X = np.empty((rows.sum(), len(terms)))
+        A = np.zeros((len(terms), len(self.choices)))
+        B = np.zeros((len(terms), len(index)))
+        for t, (choice, beta, variable) in enumerate(terms):
+            X[:, t] = values(variable)[rows]
+            A[t, self.choices.index(choice)] = 1
+            B[t, index[beta]] = 1
+
+        avail = np.column_stack([values(self._available[c])[rows] != 0
+                                 for c in self.choices])
+        return X, A, B, avail, rows
+
+    def _estimate(self):
+        """Estimate an MNL model in-process.
+
+        The log likelihood is maximized with scipy.optimize, using its analytic
+        gradient, subject to the bounds of the coefficients. Coefficient values
+        and *stats* are updated; standard errors, from the analytic Hessian,
+        are stored in *std_err*. If the optimization does not converge, a
+        RuntimeWarning is given and *converged* is False.
+        """
+        self._check_numpy('estimation')
+
+        X, A, B, avail, rows = self._arrays()
+        choice = self.data[self.choice].to_numpy()[rows]
+        Y = choice[:, None] == np.array(self.choices)[None, :]
+        if not avail[Y].all():
+            raise ValueError('Chosen alternative is not available')
+
+        beta = self._beta.astype({'value': float, 'lower': float,
+                                  'upper': float, 'fixed': bool})
+        free = ~beta['fixed'].to_numpy()
+        x0 = beta['value'].to_numpy()
+
+        def objective(x):
+            values = x0.copy()
+            values[free] = x
+            LL, gradient, _ = _mnl(values, X, A, B, avail, Y)
+            return -LL, -gradient[free]
+
+        result = minimize(objective, x0[free], jac=True, method='L-BFGS-B',
+                          bounds=beta.loc[free, ['lower', 'upper']].to_numpy())
+        self.converged = bool(result.success)
+        if not self.converged:
+            warn('Estimation of {} did not converge: {}'
+                 .format(self.name, result.message), RuntimeWarning)
+
+        values = x0.copy()
+        values[free] = result.x
+        LL, _, P = _mnl(values, X, A, B, avail, Y)
+        H = _hessian(X, A, B[:, free], P)
+
+        self._beta['value'] = values
+        self.std_err = pd.Series(np.nan, index=self._beta.index)
+        self.std_err.loc[free] = np.sqrt(np.diag(np.linalg.inv(-H)))
+
+        # Null log likelihood: equal probabilities for available alternatives
+        L0 = -np.log(avail.sum(axis=1)).sum()
+        k = int(free.sum())
+        self.stats.LB = float(LL)
+        self.stats.k = k
+        self.stats.p2 = float(1 - LL / L0)
+        self.stats.p2_adj = float(1 - (LL - k) / L0)
 
     def exclude(self, expr=None):
         """Set an expression for excluding rows for from the data set."""
@@ -366,7 +873,7 @@ class Model:
                 assert variable in self._variables, \
                     "variable '{}' not found".format(variable)
                 # Update the design matrix
-                self.D.loc[id, beta, variable] = True
+                self.D[id, beta, variable] = True
 
     def _run(self, program):
         """Common code for estimate() and simulate()."""
@@ -376,7 +883,7 @@ class Model:
         p = Popen([program + '.sh', model_fn, self._data_fn])
         p.wait()
 
-    def simulate(self):
+    def simulate(self, engine='biosim'):
         """Simulate choice probabilities.
 
         If *name* is given, the model is stored in "*name*.mod", and full
@@ -384,7 +891,13 @@ class Model:
         name attribute of the Model is used; and if neither is given, a
         ValueError is raised.
 
+        With *engine* 'numpy', MNL models are instead simulated in-process; see
+        _simulate().
+
         """
+        if engine == 'numpy':
+            return self._simulate()
+
         self._run('biosim')
         tmp = pd.read_table(fn(self, 'enu'))
         assert (len(self.data.index) == len(tmp.index) and
@@ -401,6 +914,35 @@ class Model:
             # Select the columns, then rename them from 'P_Alt1' → 1
             setattr(self, var, tmp[list(cols.keys())].rename(columns=cols))
 
+    def _simulate(self):
+        """Simulate an MNL model in-process.
+
+        Utilities *V* are computed for all rows and alternatives at once, one
+        utility term at a time. Choice probabilities *P* are computed using
+        log-sum-exp, and are zero for alternatives that are not available.
+        *resid* is 1 for the chosen alternative, minus *P*. Rows excluded by
+        *_exclude* are omitted.
+        """
+        self._check_numpy('simulation')
+
+        values, rows = self._values()
+        beta = self._beta['value'].astype(float)
+
+        V = np.zeros((rows.sum(), len(self.choices)))
+        for choice, b, variable in self.D.items():
+            V[:, self.choices.index(choice)] += beta[b] * values(variable)[rows]
+
+        avail = np.column_stack([values(self._available[c])[rows] != 0
+                                 for c in self.choices])
+        P = np.exp(_log_logit(V, avail))
+        choice = self.data[self.choice].to_numpy()[rows]
+        resid = (choice[:, None] == np.array(self.choices)[None, :]) - P
+
+        index = self.data.index[rows]
+        for var, value in dict(P=P, resid=resid, V=V).items():
+            setattr(self, var, pd.DataFrame(value, index=index,
+                                            columns=self.choices))
+
     def set_avail(self, alternative, variable):
         """Set the availability *variable* for choice *alternative*."""
         assert variable in self._variables, \
@@ -409,8 +951,12 @@ class Model:
         self._available[alternative] = variable
 
     def write(self, filename):
-        """Write the model to *filename*."""
-        with open(filename, 'w') as f:
+        """Write the model to *filename*, a path or file-like object."""
+        if isinstance(filename, (str, os.PathLike)):
+            context = open(filename, 'w')
+        else:
+            context = nullcontext(filename)
+        with context as f:
             def section(name, first=False):
                 if not first:
                     f.write('\n')
@@ -438,14 +984,9 @@ class Model:
 
             section('Utilities')
             for c in self.choices:
-                entries = [str(c), 'Alt%d' % c, self._available[c], '']
-                for var, betas in self.D.loc[c, :, :].iteritems():
-                    if not betas.any():
-                        continue
-                    betas = betas[betas == True].index.tolist()  # NOQA
-                    assert len(betas) == 1
-                    entries[-1] += '{} * {} + '.format(betas[0], var)
-                entries[-1] = entries[-1][:-3]
+                terms = ' + '.join('{} * {}'.format(*t)
+                                   for t in self.D.terms(c))
+                entries = [str(c), 'Alt%d' % c, self._available[c], terms]
                 f.write('  '.join(entries) + '\n')
 
             if any(map(lambda s: s is not None,
@@ -456,8 +997,17 @@ class Model:
                     if gu is not None:
                         f.write('{} {}\n'.format(c, gu))
 
-    def write_data(self, **kwargs):
-        self.data.to_csv(self._data_fn, index=False, sep='\t', **kwargs)
+    def write_data(self, chunk_size=100000, **kwargs):
+        """Write the data to the model's data file, *chunk_size* rows at a time.
+
+        *kwargs* are passed to pandas.DataFrame.to_csv().
+        """
+        with open(self._data_fn, 'w') as f:
+            for start in range(0, max(len(self.data), 1), chunk_size):
+                end = start + chunk_size
+                self.data.iloc[start:end].to_csv(f, header=(start == 0),
+                                                 index=False, sep='\t',
+                                                 **kwargs)
 
 
 LR = ("-2 (-{LB[0]} + {LB[1]}) = {X:.1f} > {X_crit:.1f} "
@@ -496,3 +1046,69 @@ def ms_test(full, groups, alpha=0.05):
     info['result'] = info['X'] > info['X_crit']
     info['latex'] = LR.format(**info)
     return info['result'], info
+
+
+def _init_worker(workdir):
+    """Change to a new directory under *workdir*, for one worker process."""
+    os.chdir(mkdtemp(dir=workdir))
+
+
+def _estimate_one(args):
+    """Estimate a model in a worker process; see estimate_all()."""
+    model, data_fn, engine = args
+    model._data_fn = data_fn
+    model.estimate(engine)
+    return model.stats, model._beta, model.std_err, model.converged
+
+
+def estimate_all(models, base=None, engine='biogeme', processes=None,
+                 workdir=None, alpha=0.05, cache=None):
+    """Estimate *models* in parallel, using a pool of *processes*.
+
+    Each worker process runs in its own subdirectory of *workdir*, so the
+    .mod, .rep and .res files of models with different names do not collide.
+    If *workdir* is None, a temporary directory is used and then removed.
+    *engine* is passed to Model.estimate(). The models are updated with their
+    results. If *cache* is a ResultCache, only models not found in it are
+    estimated, and their results are then stored.
+
+    Returns a pandas.DataFrame of the stats of each model, indexed by name. If
+    *base* is the name of one of *models*, each other model is compared to it
+    using lr_test() with *alpha*, and the columns 'lr_result', 'lr_X',
+    'lr_X_crit' and 'lr_df' are added.
+
+    """
+    names = [m.name for m in models]
+    if None in names or len(set(names)) < len(names):
+        raise ValueError('Models must have distinct names: {}'.format(names))
+
+    todo = [m for m in models if cache is None or not cache.get(m, engine)]
+    args = [(m, os.path.abspath(m._data_fn), engine) for m in todo]
+
+    with TemporaryDirectory() as tmp:
+        workdir = tmp if workdir is None else workdir
+        with ProcessPoolExecutor(processes, initializer=_init_worker,
+                                 initargs=(os.path.abspath(workdir),)) as pool:
+            for m, result in zip(todo, pool.map(_estimate_one, args)):
+                m.stats, m._beta, m.std_err, m.converged = result
+                if cache is not None:
+                    cache.put(m, engine)
+
+    result = pd.DataFrame([vars(m.stats) for m in models], index=names)
+    result.index.name = 'name'
+
+    if base is not None:
+        b = models[names.index(base)]
+        lr = {}
+        for m in models:
+            if m is b:
+                continue
+            # The model with more estimated parameters is unrestricted
+            u, r = (m, b) if m.stats.k > b.stats.k else (b, m)
+            _, info = lr_test(u, r, alpha)
+            lr[m.name] = dict(lr_result=info['result'], lr_X=info['X'],
+                              lr_X_crit=info['X_crit'],
+                              lr_df=u.stats.k - r.stats.k)
+        result = result.join(pd.DataFrame.from_dict(lr, orient='index'))
+
+    return result
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """Interactively process files reported by duff, fdupes, or rdfind.
 
+\b
 Use one of the following:
 $ duff -ar . >duplicates.duff
 $ fdupes -HrS . >duplicate.fdupes
@@ -9,15 +10,34 @@ $ rdfind -ignoreempty false -checksum sha1 -outputname duplicates.rdfind
 (You can also prepend "/usr/bin/time -o timer" to keep track of the execution
 time.)
 
+\b
 Then call:
-$ dedupe duplicates.EXT
+$ dedupe show duplicates.EXT
+
+"dedupe duplicates.EXT", without a command, is the same.
+
+\b
+Or, to find duplicates directly:
+$ dedupe scan PATH [PATH...]
+
+\b
+To remove duplicates, write a plan, review it, and apply it:
+$ dedupe plan duplicates.EXT
+$ dedupe apply dedupe-plan.txt
 
 """
 from collections import defaultdict
-import os.path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import sha1
+from itertools import groupby
+from mmap import ACCESS_READ, mmap
+from operator import itemgetter
+import os
 from os.path import commonpath, split
-import pickle
+from pathlib import Path
 import re
+import sqlite3
+from stat import S_ISREG
 
 import click
 import tqdm
@@ -29,30 +49,39 @@ group_re = {
         r"\((?P<size>\d+) bytes, digest (?P<digest>\w{40})\)"
     ),
     "fdupes": re.compile(r"(?P<size>\d+) byte[s]? each:"),
+    # Only the file header; groups are read in bulk by iter_rdfind()
+    "rdfind": re.compile(r"# Automatically generated"),
 }
 
+# Keys for indexing groups; see index_keys()
+INDEX_KEYS = ("reclaim", "count", "size", "cpath", "rcpath", "base", "name")
+
 
 class Group:
     next_id = 1
 
-    def __init__(self, format, line):
-        try:
-            groupdict = group_re[format].match(line).groupdict()
-        except AttributeError:
-            raise ValueError("Unable to parse line: '%s'", line)
+    def __init__(self, format, line=None, **data):
+        if line is not None:
+            try:
+                data = group_re[format].match(line).groupdict()
+            except AttributeError:
+                raise ValueError("Unable to parse line: '%s'", line)
 
         self.format = format
 
-        self.digest = groupdict.pop("digest", "")
-        for k, v in groupdict.items():
+        self.paths = data.pop("paths", [])
+        # (st_dev, st_ino) for each of `paths`, or None if unknown
+        self.inodes = data.pop("inodes", None)
+        self.digest = data.pop("digest", "")
+        for k, v in data.items():
             setattr(self, k, int(v))
 
-        self.expecting = getattr(self, "count", 0)
+        self.expecting = getattr(self, "count", 0) - len(self.paths)
         self.id = getattr(self, "id", Group.next_id)
         Group.next_id += 1
 
-        self.finished = False
-        self.paths = []
+        # A group constructed with all its paths is already finished
+        self.finished = len(self.paths) > 0 and self.expecting == 0
 
     def add_file(self, path):
         if self.format == "fdupes" and path.strip() == "":
@@ -71,13 +100,49 @@ class Group:
             "#{0.id:5d} — {0.count} files — {0.size} bytes — {0.digest}".format(self)
         ]
 
-        if self.count > 10:
-            paths = self.paths[:5] + ["…"] + self.paths[-5:]
-        else:
-            paths = self.paths
+        # Hard links to the same inode are shown on one line
+        paths = [" = ".join(copy) for copy in self.copies]
+
+        if len(paths) > 10:
+            paths = paths[:5] + ["…"] + paths[-5:]
 
         return "\n".join(info + paths)
 
+    @property
+    def copies(self):
+        """List of lists of paths; one for each distinct inode.
+
+        Paths with unknown inodes are treated as distinct copies.
+        """
+        result = {}
+        for path, inode in zip(self.paths, self.inodes or [None] * len(self.paths)):
+            result.setdefault(inode or path, []).append(path)
+        return list(result.values())
+
+    @property
+    def reclaimable(self):
+        """Bytes reclaimed by removing all but one copy."""
+        return (len(self.copies) - 1) * self.size
+
+    def stat(self):
+        """Record the device and inode of each path, if it exists."""
+        self.inodes = []
+        for path in self.paths:
+            try:
+                info = os.lstat(path)
+            except OSError:
+                self.inodes.append(None)
+            else:
+                self.inodes.append((info.st_dev, info.st_ino))
+
+    @property
+    def signature(self):
+        """Hash of the group's digest, size, and set of paths."""
+        h = sha1("{0.digest}\0{0.size}".format(self).encode())
+        for path in sorted(self.paths):
+            h.update(b"\0" + path.encode(errors="surrogateescape"))
+        return h.hexdigest()
+
 
 def determine_format(filename):
     with open(filename) as f:
@@ -90,23 +155,141 @@ def determine_format(filename):
     raise ValueError("Can't determine format for initial line:\n%s", first_line)
 
 
+def _narrow_prefix(prefix, string):
+    """Shorten `prefix` until `string` starts with it."""
+    lo, hi = 0, min(len(prefix), len(string))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if string.startswith(prefix[:mid]):
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix[:lo]
+
+
+def _narrow_suffix(suffix, string):
+    """Shorten `suffix` until `string` ends with it."""
+    lo, hi = 0, min(len(suffix), len(string))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        start = len(suffix) - mid
+        if string.endswith(suffix[start:]):
+            lo = mid
+        else:
+            hi = mid - 1
+    start = len(suffix) - lo
+    return suffix[start:]
+
+
 def commonsuffix(strings):
-    def gen(strs):
-        N = len(strs)
-        for k in zip(*map(reversed, strs)):
-            if any([k[i] != k[0] for i in range(1, N)]):
-                break
-            yield k[0]
+    result = None
+    for s in strings:
+        if result is None:
+            result = s
+        elif not s.endswith(result):
+            result = _narrow_suffix(result, s)
+    return result or ""
+
+
+class PathSummary:
+    """Common path and suffix, and distinct heads and tails, of `paths`.
+
+    These are computed in a single pass. The common prefix and suffix are only
+    narrowed—by bisection, using :meth:`str.startswith` and :meth:`str.endswith`—
+    when a path does not already match them, so in a large group of similar paths
+    most paths cost two string comparisons. At most `max_parts` distinct heads and
+    tails are collected.
+
+    Attributes
+    ----------
+    cpath : str
+        Same as :func:`os.path.commonpath` for normalized `paths`.
+    suffix : str
+        Same as :func:`commonsuffix`.
+    heads, tails : set of str
+        As returned by :func:`os.path.split`.
+    """
+
+    def __init__(self, paths, max_parts=3):
+        prefix = suffix = None
+        # Characters following `prefix` in each path; "" for the end of a path
+        ends = set()
+        heads, tails = set(), set()
+
+        for path in paths:
+            if prefix is None:
+                prefix = suffix = path
+            else:
+                if not path.startswith(prefix):
+                    # All previous paths have this character after the new prefix
+                    new = _narrow_prefix(prefix, path)
+                    ends = {prefix[len(new)]}
+                    prefix = new
+                if not path.endswith(suffix):
+                    suffix = _narrow_suffix(suffix, path)
+
+            N = len(prefix)
+            ends.add(path[N] if len(path) > N else "")
+
+            head, sep, tail = path.rpartition("/")
+            if len(heads) < max_parts:
+                heads.add((head + sep).rstrip("/") or head + sep)
+            if len(tails) < max_parts:
+                tails.add(tail)
+
+        if not ends <= {"", "/"}:
+            # The prefix ends partway through a component; discard it
+            prefix = prefix[: prefix.rfind("/") + 1]
+
+        self.cpath = commonpath([prefix]) if prefix else ""
+        self.suffix = suffix or ""
+        self.heads = heads
+        self.tails = tails
+
+
+def benchmark(N=10000):
+    """Return cases for timing :class:`PathSummary`; see "khaeru benchmark".
+
+    :class:`PathSummary` is compared to separate per-group computations, those
+    formerly used by :func:`index_keys`. Synthetic groups of `N` paths are used,
+    resembling duplicated node_modules and build trees.
+    """
+
+    def commonsuffix_zip(strings):
+        def gen(strs):
+            N = len(strs)
+            for k in zip(*map(reversed, strs)):
+                if any([k[i] != k[0] for i in range(1, N)]):
+                    break
+                yield k[0]
+
+        return ("".join(gen(strings)))[::-1]
+
+    def separate(paths):
+        commonpath(paths)
+        commonsuffix_zip(paths)
+        heads, tails = map(set, zip(*map(split, paths)))
+
+    groups = {
+        "node_modules": [
+            f"/srv/backup/{i}/project/node_modules/lodash/lodash.js" for i in range(N)
+        ],
+        "build tree": [f"/srv/build/{i % 97}/out/obj/{i}/empty.o" for i in range(N)],
+    }
+    return separate, PathSummary, groups
 
-    return ("".join(gen(strings)))[::-1]
 
+def iter_groups(filename, format, stat=False):
+    """Iterate over the :class:`Group` in `filename`.
 
-def read_groups(filename, format):
-    groups = dict()
-    index = {
-        k: defaultdict(set)
-        for k in ("count", "size", "cpath", "rcpath", "base", "name")
-    }
+    Groups are yielded as soon as they are complete, and are not retained, so memory
+    use does not depend on the size of the report. If `stat` is :obj:`True`, the
+    inodes of files are recorded with :meth:`Group.stat`; rdfind output already
+    contains them.
+    """
+    if format == "rdfind":
+        yield from iter_rdfind(filename)
+        return
 
     group = None
     with open(filename) as f:
@@ -115,113 +298,660 @@ def read_groups(filename, format):
                 group.add_file(line[:-1])
             else:
                 group = Group(format, line)
-                groups[group.id] = group
                 continue
 
             if group.finished:
-                index["count"][group.count].add(group.id)
-                index["size"][group.size].add(group.id)
+                if stat:
+                    group.stat()
+                yield group
+                group = None
 
-                cpath = commonpath(group.paths)
-                index["cpath"][cpath].add(group.id)
 
-                rcpath = commonsuffix(group.paths)
-                if "/" in rcpath:
-                    index["rcpath"][rcpath].add(group.id)
+def iter_rdfind(filename, chunk_size=1 << 24):
+    """Iterate over the :class:`Group` in rdfind's output `filename`.
 
-                heads, tails = map(set, zip(*map(split, group.paths)))
+    Each line of rdfind output has the columns "duptype id depth size device inode
+    priority name"; each group starts with a line of type DUPTYPE_FIRST_OCCURRENCE.
 
-                if len(heads) <= 2:
-                    index["base"][":".join(sorted(heads))].add(group.id)
+    Lines are read and split into columns in chunks of about `chunk_size` bytes, and
+    each group is constructed from all of its rows at once.
+    """
+    progress = tqdm.tqdm(unit=" lines")
+    rows = []
+    with open(filename) as f:
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                break
+            progress.update(len(lines))
+
+            rows.extend(
+                line.rstrip("\n").split(" ", 7)
+                for line in lines
+                if not line.startswith("#") and line.strip()
+            )
+
+            # Indices of the first rows of each group
+            starts = [
+                i for i, r in enumerate(rows) if r[0] == "DUPTYPE_FIRST_OCCURRENCE"
+            ]
+
+            # Yield all but the last group, which may continue in the next chunk
+            for start, end in zip(starts, starts[1:]):
+                yield _rdfind_group(rows[start:end])
+
+            if starts:
+                last = starts[-1]
+                rows = rows[last:]
+
+    progress.close()
+
+    if rows:
+        yield _rdfind_group(rows)
+
+
+def _rdfind_group(rows):
+    return Group(
+        "rdfind",
+        id=rows[0][1],
+        size=rows[0][3],
+        count=len(rows),
+        paths=[r[7] for r in rows],
+        inodes=[(int(r[4]), int(r[5])) for r in rows],
+    )
+
+
+def index_keys(group):
+    """Yield (by, key) pairs under which `group` is indexed."""
+    yield "reclaim", group.reclaimable
+    yield "count", group.count
+    yield "size", group.size
+
+    info = PathSummary(group.paths)
+
+    yield "cpath", info.cpath
+
+    if "/" in info.suffix:
+        yield "rcpath", info.suffix
+
+    if len(info.heads) <= 2:
+        yield "base", ":".join(sorted(info.heads))
+
+    if len(info.tails) <= 2:
+        yield "name", ":".join(sorted(info.tails))
+
+
+class Cache:
+    """On-disk SQLite store of groups and their index, in ``FILENAME.dedupe-cache``.
+
+    The table "keys" holds one row for each (index, key, group) entry generated by
+    :func:`index_keys`, with an SQL index on (idx, key), so that the clusters with the
+    largest keys can be selected without reading the rest of the cache. Groups are
+    also indexed by :attr:`Group.signature`, for :func:`update_groups`.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS groups (
+            id INTEGER PRIMARY KEY, format TEXT, count INTEGER, size INTEGER,
+            digest TEXT, signature TEXT
+        );
+        CREATE INDEX IF NOT EXISTS groups_signature ON groups (signature);
+        CREATE TABLE IF NOT EXISTS paths (
+            group_id INTEGER, path TEXT, dev INTEGER, ino INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS paths_group_id ON paths (group_id);
+        CREATE TABLE IF NOT EXISTS keys (idx TEXT, key, group_id INTEGER);
+        CREATE INDEX IF NOT EXISTS keys_idx_key ON keys (idx, key);
+        CREATE TABLE IF NOT EXISTS counts (idx TEXT PRIMARY KEY, count INTEGER);
+        CREATE TEMP TABLE keep (id INTEGER PRIMARY KEY);
+    """
+
+    def __init__(self, filename, create=False):
+        path = Path("{}.dedupe-cache".format(filename))
+        if create:
+            path.unlink(missing_ok=True)
+        elif not path.exists():
+            raise click.ClickException(f"No cache {path}")
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.db.commit()
+        self.db.close()
+
+    def add_group(self, group):
+        self.db.execute(
+            "INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                group.id,
+                group.format,
+                group.count,
+                group.size,
+                group.digest,
+                group.signature,
+            ),
+        )
+        inodes = group.inodes or [None] * len(group.paths)
+        self.db.executemany(
+            "INSERT INTO paths VALUES (?, ?, ?, ?)",
+            (
+                (group.id, path, *(inode or (None, None)))
+                for path, inode in zip(group.paths, inodes)
+            ),
+        )
+
+    def add_keys(self, rows):
+        """Add `rows` of (idx, key, group_id) to the index."""
+        self.db.executemany("INSERT INTO keys VALUES (?, ?, ?)", rows)
+
+    def _group(self, row, paths):
+        """Construct a group from a `row` of the "groups" table and rows of `paths`."""
+        id, format, count, size, digest = row
+        return Group(
+            format,
+            id=id,
+            count=count,
+            size=size,
+            digest=digest,
+            paths=[p[0] for p in paths],
+            inodes=[None if p[1] is None else p[1:] for p in paths],
+        )
+
+    def group(self, id):
+        row = self.db.execute(
+            "SELECT id, format, count, size, digest FROM groups WHERE id = ?", (id,)
+        ).fetchone()
+        paths = self.db.execute(
+            "SELECT path, dev, ino FROM paths WHERE group_id = ? ORDER BY rowid", (id,)
+        )
+        return self._group(row, paths.fetchall())
+
+    def groups(self):
+        """Iterate over all stored groups."""
+        cursor = self.db.execute(
+            "SELECT g.id, g.format, g.count, g.size, g.digest, p.path, p.dev, p.ino "
+            "FROM groups AS g JOIN paths AS p ON p.group_id = g.id "
+            "ORDER BY g.id, p.rowid"
+        )
+        for row, rows in groupby(cursor, key=itemgetter(slice(5))):
+            yield self._group(row, [r[5:] for r in rows])
+
+    def count_keys(self):
+        """Store the number of distinct keys in each index, for :meth:`count`."""
+        self.db.execute("DELETE FROM counts")
+        self.db.execute(
+            "INSERT INTO counts SELECT idx, count(DISTINCT key) FROM keys GROUP BY idx"
+        )
+
+    def count(self, by):
+        """Return the number of distinct keys in the index `by`."""
+        row = self.db.execute("SELECT count FROM counts WHERE idx = ?", (by,))
+        return (row.fetchone() or (0,))[0]
+
+    def top(self, by, limit, offset=0):
+        """Return the `limit` largest keys in the index `by`, with their group IDs.
+
+        The first `offset` keys are skipped. Keys are read in order from the SQL index
+        on (idx, key), so no sorting is performed.
+        """
+        cursor = self.db.execute(
+            "SELECT key, group_concat(group_id) FROM keys WHERE idx = ? GROUP BY key "
+            "ORDER BY key DESC LIMIT ? OFFSET ?",
+            (by, limit, offset),
+        )
+        return [(key, set(map(int, ids.split(",")))) for key, ids in cursor]
+
+    def find(self, signature):
+        """Return the ID of the stored group with `signature`, or :obj:`None`."""
+        row = self.db.execute(
+            "SELECT id FROM groups WHERE signature = ?", (signature,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def max_id(self):
+        return self.db.execute("SELECT coalesce(max(id), 0) FROM groups").fetchone()[0]
+
+    def keep(self, id):
+        """Mark the group `id` to be kept by :meth:`prune`."""
+        self.db.execute("INSERT INTO temp.keep VALUES (?)", (id,))
+
+    def prune(self):
+        """Remove all groups not marked with :meth:`keep`; return the number removed."""
+        N = self.db.execute(
+            "DELETE FROM groups WHERE id NOT IN (SELECT id FROM temp.keep)"
+        ).rowcount
+        for table in "paths", "keys":
+            self.db.execute(
+                f"DELETE FROM {table} WHERE group_id NOT IN (SELECT id FROM temp.keep)"
+            )
+        return N
+
+
+def build_index(groups, cache, spill=100000):
+    """Index `groups` into `cache`.
+
+    Index entries are accumulated in memory and written to `cache` every `spill`
+    entries, so that peak memory use is bounded regardless of the number of groups.
+    """
+    rows = []
+    for group in groups:
+        rows.extend((by, key, group.id) for by, key in index_keys(group))
+
+        if len(rows) >= spill:
+            cache.add_keys(rows)
+            rows = []
+
+    cache.add_keys(rows)
+
+
+def read_groups(filename, format, stat=False):
+    """Read groups from `filename` and store them, with their index, in the cache."""
+    with Cache(filename, create=True) as cache:
+        # First pass: store groups on disk as they are parsed
+        N = 0
+        for group in iter_groups(filename, format, stat):
+            cache.add_group(group)
+            N += 1
+
+        print("Read %d groups" % N)
+
+        # Second pass: build the index from the stored groups
+        build_index(cache.groups(), cache)
+        cache.count_keys()
+
+
+def update_groups(filename, format, stat=False):
+    """Update the cache for `filename` with only the groups that have changed.
+
+    Each group in `filename` is looked up in the cache by :attr:`Group.signature`.
+    Groups that are not found are stored and indexed; stored groups that no longer
+    appear in `filename` are removed. Unchanged groups are not re-indexed.
+    """
+    with Cache(filename) as cache:
+        first_id = next_id = cache.max_id() + 1
+
+        def changed():
+            nonlocal next_id
+            for group in iter_groups(filename, format, stat):
+                id = cache.find(group.signature)
+                if id is None:
+                    # New or changed group; renumber to avoid clashing with stored IDs
+                    id = group.id = next_id
+                    next_id += 1
+                    cache.add_group(group)
+                    yield group
+                cache.keep(id)
+
+        build_index(changed(), cache)
+        removed = cache.prune()
+        cache.count_keys()
+
+        print("Added %d, removed %d groups" % (next_id - first_id, removed))
+
+
+def _hash(args):
+    """Return the SHA-1 digest of `path`, or of its first and last `part` bytes.
+
+    If the file is no larger than 2 × `part` bytes, the digest of its full contents is
+    returned.
+
+    The file is read through :mod:`mmap`. :obj:`None` is returned if it can't be read.
+    """
+    path, size, part = args
+    try:
+        with open(path, "rb") as f, mmap(f.fileno(), 0, access=ACCESS_READ) as m:
+            if part and size > 2 * part:
+                return sha1(m[:part] + m[-part:]).hexdigest()
+            return sha1(m).hexdigest()
+    except (OSError, ValueError):
+        return None
+
+
+def scan(paths, processes=None, part=4096):
+    """Find duplicate files under `paths`.
+
+    Files are grouped by size; then files of the same size by the digest of their
+    first and last `part` bytes; then, for files larger than 2 × `part` bytes, by the
+    digest of their full contents. Digests are computed in a pool of `processes`.
+
+    Only one path is read for each inode. The groups yielded are equivalent to those
+    read from duff output, with :attr:`Group.inodes` recorded.
+    """
+    # Group regular, non-empty files by size
+    by_size = defaultdict(list)
+    for top in paths:
+        for dirpath, _, filenames in tqdm.tqdm(os.walk(top), unit=" dirs"):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    info = os.lstat(path)
+                except OSError:
+                    continue
+                if S_ISREG(info.st_mode) and info.st_size > 0:
+                    inode = (info.st_dev, info.st_ino)
+                    by_size[info.st_size].append((path, inode))
+
+    files = [(*f, size) for size, fs in by_size.items() if len(fs) > 1 for f in fs]
+    del by_size
+
+    with ProcessPoolExecutor(processes) as pool:
+
+        def refine(files, part):
+            """Group `files` by size and digest, discarding unique files."""
+            # Hash one path for each inode
+            first = {}
+            for path, inode, size in files:
+                first.setdefault(inode, (path, size, part))
+            digests = tqdm.tqdm(
+                pool.map(_hash, first.values(), chunksize=64), total=len(first)
+            )
+            digests = dict(zip(first.keys(), digests))
+
+            result = defaultdict(list)
+            for path, inode, size in files:
+                if digests[inode] is not None:
+                    result[(size, digests[inode])].append((path, inode))
+            return [(key, files) for key, files in result.items() if len(files) > 1]
+
+        def group(size, digest, files):
+            paths, inodes = map(list, zip(*files))
+            return Group(
+                "duff",
+                size=size,
+                count=len(paths),
+                digest=digest,
+                paths=paths,
+                inodes=inodes,
+            )
+
+        # For small files, the partial digest is the digest of the full contents
+        full = []
+        for (size, digest), files in refine(files, part):
+            if size > 2 * part:
+                full.extend((path, inode, size) for path, inode in files)
+            else:
+                yield group(size, digest, files)
 
-                if len(tails) <= 2:
-                    index["name"][":".join(sorted(tails))].add(group.id)
+        for (size, digest), files in refine(full, 0):
+            yield group(size, digest, files)
 
-                group = None
 
-    print("Read %d groups" % len(groups))
+def show(cache, indices=INDEX_KEYS, limit=5, offset=0):
+    """Print up to `limit` clusters in each of the `indices` of `cache`.
 
-    with open("{}.dedupe-cache".format(filename), "wb") as f:
-        pickle.dump(groups, f)
-        pickle.dump(index, f)
+    The first `offset` clusters in each index are skipped.
+    """
+    for by in indices:
+        print(
+            "%d clusters by %s; %d to %d:"
+            % (cache.count(by), by, offset + 1, offset + limit)
+        )
 
-    return groups, index
+        for k, v in cache.top(by, limit, offset):
+            print("%s '%s': %d group(s) with ids %s" % (by, k, len(v), v))
 
+            for group_id in v:
+                print(cache.group(group_id))
 
-@click.command()
-@click.argument("filename", type=click.Path(exists=True))
-@click.option("--limit", type=int, default=5)
-@click.option("--use-cache", is_flag=True)
-def cli(filename, limit, use_cache):
-    if use_cache:
-        with open("{}.dedupe-cache".format(filename), "rb") as f:
-            groups = pickle.load(f)
-            index = pickle.load(f)
-    else:
-        fmt = determine_format(filename)
-        groups, index = read_groups(filename, fmt)
+            print("")
 
-    for by, idx in index.items():
-        print("%d clusters by %s" % (len(idx), by))
 
-        count = limit
-        for k, v in reversed(sorted(idx.items())):
-            print("%s '%s': %d group(s) with ids %s" % (by, k, len(v), v))
+def choose(group, prefix=None):
+    """Return the path in `group` to keep, or :obj:`None` to skip the group.
 
-            for group_id in v:
-                print(groups[group_id])
+    If `prefix` is given, the first path starting with `prefix` is kept. Otherwise,
+    the path with the oldest modification time is kept.
+    """
+    if prefix is not None:
+        return next((p for p in group.paths if p.startswith(prefix)), None)
 
-            print("")
+    mtimes = {}
+    for path in group.paths:
+        try:
+            mtimes[path] = os.lstat(path).st_mtime
+        except OSError:
+            return None
+    return min(mtimes, key=mtimes.get)
 
-            count -= 1
-            if count == 0:
-                break
 
+def fingerprint(path):
+    """Return a string identifying the current contents of `path`.
 
-# Old methods
+    This combines the size, modification time in nanoseconds, and inode of the file.
+    """
+    info = os.lstat(path)
+    return "{0.st_size}:{0.st_mtime_ns}:{0.st_ino}".format(info)
 
 
-def file_recursive(target, path, data):
-    key = path.pop(0)
-    if key not in target:
-        target[key] = dict()
-    if len(path):
-        file_recursive(target[key], path, data)
-    else:
-        target[key][data["id"]] = data
+def plan(groups, action="rm", prefix=None):
+    """Yield an operation for every path in `groups` that is not kept.
 
+    Each operation is (action, path, kept, fingerprint, kept fingerprint). The kept
+    path is chosen with :func:`choose`. Hard links to the kept path are skipped.
+    `action` is "rm", to delete the path; or "ln", to replace it with a hard link to
+    the kept path. The :func:`fingerprint` of both files is recorded, so that
+    :func:`apply_plan` can refuse to touch files that have since changed.
+    """
+    for group in groups:
+        kept = choose(group, prefix)
+        if kept is None:
+            continue
+
+        try:
+            kept_fp = fingerprint(kept)
+        except OSError:
+            continue
 
-def print_group(g, indent=0):
-    """Print information about a group of duplicate files."""
-    indent_ = "  " * indent
+        for copy in group.copies:
+            if kept in copy:
+                continue
+            for path in copy:
+                try:
+                    yield action, path, kept, fingerprint(path), kept_fp
+                except OSError:
+                    continue
 
 
-def ls(path):
-    """List groups and subdirectories at *path*."""
-    target = groups_by_path
-    for dir in path.split("/"):
-        target = target[dir]
-    for k, v in target.items():
-        if type(k) is int:
-            print_group(v)
-        else:
-            print("{} {}".format(len(v), k))
-
-
-def prune(id_):
-    cpath = os.path.commonpath(groups_by_id[id_]["files"]).split("/")
-    target = [groups_by_path]
-    for dir in cpath:
-        target.append(target[-1][dir])
-    # Prune the selected group
-    del target[-1][id_]
-    # Prune empty directories
-    for i in reversed(range(1, len(target))):
-        if len(target[i]) == 0:
-            del target[i - 1][cpath[i - 1]]
-
-
-def skip(id_):
-    if id_ not in done["skip"]:
-        done["skip"].add(id_)
-        prune(id_)
+def _apply_dir(directory, ops, dry_run):
+    """Apply `ops` to files in `directory`, then fsync it; return bytes reclaimed."""
+    reclaimed = 0
+    for action, path, kept, *fps in ops:
+        try:
+            info, kept_info = os.lstat(path), os.lstat(kept)
+            if not (S_ISREG(info.st_mode) and S_ISREG(kept_info.st_mode)):
+                raise ValueError("not a regular file")
+            elif (info.st_dev, info.st_ino) == (kept_info.st_dev, kept_info.st_ino):
+                continue  # Already the same file
+            elif fps != [fingerprint(path), fingerprint(kept)]:
+                raise ValueError("changed since the plan was written")
+
+            if dry_run:
+                pass
+            elif action == "rm":
+                os.unlink(path)
+            elif action == "ln":
+                tmp = path + ".dedupe-tmp"
+                os.link(kept, tmp)
+                os.replace(tmp, path)
+        except (OSError, ValueError) as e:
+            print("Skip {} {}: {}".format(action, path, e))
+            continue
+
+        if info.st_nlink == 1:
+            reclaimed += info.st_size
+
+    if not dry_run:
+        fd = os.open(directory or ".", os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    return reclaimed
+
+
+def apply_plan(lines, dry_run=False):
+    """Apply the plan in `lines`, as written by "dedupe plan"; return bytes reclaimed.
+
+    Operations are batched by directory, and each directory is fsync'ed once after its
+    batch. Operations on files whose :func:`fingerprint` differs from the one in the
+    plan are skipped. Batches on different devices are applied in parallel threads.
+    """
+    batches = defaultdict(list)
+    for line in lines:
+        op = line.rstrip("\n").split("\t")
+        batches[os.path.dirname(op[1])].append(op)
+
+    by_device = defaultdict(list)
+    for directory, ops in batches.items():
+        try:
+            device = os.stat(directory or ".").st_dev
+        except OSError:
+            device = None
+        by_device[device].append((directory, ops))
+
+    def apply_device(batches):
+        return sum(_apply_dir(d, ops, dry_run) for d, ops in batches)
+
+    with ThreadPoolExecutor(max(1, len(by_device))) as pool:
+        return sum(pool.map(apply_device, by_device.values()))
+
+
+class DefaultGroup(click.Group):
+    """Group that runs "show" when called with a report file instead of a command.
+
+    This keeps the original invocation, "dedupe duplicates.EXT [OPTIONS]", working.
+    """
+
+    def parse_args(self, ctx, args):
+        if (
+            args
+            and args[0] not in self.commands
+            and any(os.path.isfile(arg) for arg in args)
+        ):
+            args = ["show"] + args
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, help=__doc__)
+def cli():
+    pass
+
+
+@cli.command("show")
+@click.argument("filename", type=click.Path(exists=True))
+@click.option(
+    "--by",
+    type=click.Choice(INDEX_KEYS),
+    multiple=True,
+    help="Index(es) to show; default all.",
+)
+@click.option("--limit", type=int, default=5, help="Clusters per page.")
+@click.option("--offset", type=int, default=0, help="Clusters to skip.")
+@click.option(
+    "-i", "--interactive", is_flag=True, help="Prompt to show successive pages."
+)
+@click.option("--use-cache", is_flag=True)
+@click.option(
+    "--update", is_flag=True, help="Update the cache with only the changed groups."
+)
+@click.option(
+    "--stat", is_flag=True, help="Record inodes of files, to identify hard links."
+)
+def show_cmd(filename, by, limit, offset, interactive, use_cache, update, stat):
+    """Show duplicate files reported in FILENAME."""
+    if update:
+        update_groups(filename, determine_format(filename), stat)
+    elif not use_cache:
+        fmt = determine_format(filename)
+        read_groups(filename, fmt, stat)
+
+    with Cache(filename) as cache:
+        while True:
+            show(cache, by or INDEX_KEYS, limit, offset)
+
+            if not (interactive and click.confirm("Next page?", default=True)):
+                break
+            offset += limit
+
+
+@cli.command("scan")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--output",
+    "-o",
+    default="duplicates.duff",
+    show_default=True,
+    help="Write a report in duff format.",
+)
+@click.option("--limit", type=int, default=5)
+@click.option("-j", "--processes", type=int, help="Number of processes.")
+def scan_cmd(paths, output, limit, processes):
+    """Find duplicate files in PATHS.
+
+    Results are written to OUTPUT, which can be passed to "dedupe show".
+    """
+    with open(output, "w") as f, Cache(output, create=True) as cache:
+        N = 0
+        for group in scan(paths, processes):
+            group.id = N = N + 1
+            f.write(
+                "{0.count} files in cluster {0.id} ({0.size} bytes, digest {0.digest})"
+                "\n".format(group)
+            )
+            f.writelines(path + "\n" for path in group.paths)
+            cache.add_group(group)
+
+        print("Found %d groups" % N)
+
+        build_index(cache.groups(), cache)
+        cache.count_keys()
+        show(cache, limit=limit)
+
+
+@cli.command("plan")
+@click.argument("filename", type=click.Path(exists=True))
+@click.option(
+    "--keep-under",
+    "prefix",
+    metavar="PREFIX",
+    help="Keep the file under PREFIX; default: keep the oldest file.",
+)
+@click.option(
+    "--hardlink", is_flag=True, help="Replace other files with hard links to it."
+)
+@click.option(
+    "--output",
+    "-o",
+    default="dedupe-plan.txt",
+    show_default=True,
+    help="File for the plan.",
+)
+def plan_cmd(filename, prefix, hardlink, output):
+    """Plan to remove duplicates in FILENAME.
+
+    One file in each group is kept, and the others are deleted, or replaced with hard
+    links. FILENAME must first be read with "dedupe show". The plan is written to
+    OUTPUT, for review before "dedupe apply".
+    """
+    action = "ln" if hardlink else "rm"
+    with Cache(filename) as cache, open(output, "w") as f:
+        N = 0
+        for op in plan(tqdm.tqdm(cache.groups()), action, prefix):
+            f.write("\t".join(op) + "\n")
+            N += 1
+
+    print("Wrote {} operations to {}".format(N, output))
+
+
+@cli.command("apply")
+@click.argument("plan", type=click.File())
+@click.option("--dry-run", is_flag=True, help="Only check what would be done.")
+def apply_cmd(plan, dry_run):
+    """Apply the PLAN from "dedupe plan"."""
+    reclaimed = apply_plan(plan, dry_run)
+    print("{} {} bytes".format("Would reclaim" if dry_run else "Reclaimed", reclaimed))
@@ -7,8 +7,6 @@ import os
 from pathlib import Path
 
 from colorama import Fore as fg
-from git import Repo
-from git.exc import GitCommandError
 
 HOME = Path("~").expanduser()
 
@@ -26,21 +24,9 @@ IGNORE = [
 ]
 
 
-# Parse simple arguments
-parser = argparse.ArgumentParser(description=__doc__)
-parser.add_argument(
-    "--fetch", action="store_true", help="fetch remotes for comparison (slow)"
-)
-parser.add_argument(
-    "--all",
-    dest="verbose",
-    action="store_true",
-    help="also show information about ignored repos",
-)
-args = parser.parse_args()
-
-
 def find_repos():
+    from git import Repo
+
     for dirpath, dirnames, _ in os.walk(HOME):
         if any(Path(dirpath).is_relative_to(p) for p in IGNORE):
             continue
@@ -70,6 +56,21 @@ def plural(num):
 
 
 def main():
+    from git.exc import GitCommandError
+
+    # Parse simple arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--fetch", action="store_true", help="fetch remotes for comparison (slow)"
+    )
+    parser.add_argument(
+        "--all",
+        dest="verbose",
+        action="store_true",
+        help="also show information about ignored repos",
+    )
+    args = parser.parse_args()
+
     clean = 0
 
     for repo in find_repos():
@@ -1,104 +1,644 @@
-"""Usage: imgdupe DIR1 DIR2
+"""Find duplicate images in DIRS.
 
-Find image files in DIR1 and DIR2 with matching names and image data, but
-possibly different sizes or (EXIF etc.) metadata. ImageMagick ('identify'
-binary, which must be available) is used to compute the SHA-256 of the image
-*data* only.
+Find image files in DIRS with matching names and image data, but possibly different
+sizes or (EXIF etc.) metadata. ImageMagick ('identify' and 'convert' binaries, which
+must be available) or Pillow is used to compute the SHA-256 of the image *data* only.
+Images are decoded in a pool of processes. Hashes from different backends differ, so
+use the same one for all runs.
 
-The list of duplicate files is written to duplicates.txt.
+Files with the extensions given by --ext (default: jpg) are compared. DIRS are scanned
+by a pool of threads, and the list of duplicate files is written to duplicates.txt as
+groups of files with the same name are found. Where files have the same name, the one
+in the highest-priority directory is kept. By default, that is the earliest of DIRS.
+
+With --priority, directories are instead ranked by a RULES file. Each line of RULES is
+a glob pattern, matched against the path of each directory, e.g. "photos/best/*".
+Blank lines and lines starting with "#" are ignored. Directories matching an earlier
+line have higher priority, and those matching no line have the lowest priority, in
+the order of DIRS.
+
+With --similar, images are also compared regardless of their names, using
+perceptual hashes (aHash and dHash) of their appearance. This finds renamed copies,
+with identical or resized image data. Similar images are displayed, but not written
+to duplicates.txt.
+
+Hashes and EXIF data are cached in CACHE, keyed by each file's absolute path, size,
+modification time and inode. Files are only decoded again if any of these change.
 
 Tips!
+
+\b
 - The verbose output can be captured by piping to 'tee'.
-- Use something like "cat duplicates.txt | tr '\n' '\0' | xargs -0 gvfs-trash"
+- Use something like "cat duplicates.txt | tr '\\n' '\\0' | xargs -0 gvfs-trash"
   to reversibly delete the duplicate files.
-
 """
 
 from collections import defaultdict
-from itertools import combinations
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from fnmatch import fnmatch
+from hashlib import sha256
+from heapq import merge
+from importlib.util import find_spec
+from itertools import groupby, islice
+from operator import itemgetter
 import os
 import os.path
+from pathlib import Path
+import pickle
 import re
-from subprocess import check_output
-import sys
-
-# Locate all images in the named directories
-fnre = re.compile("^.*jpg$", flags=re.IGNORECASE)
-images = set()
-for i, path in enumerate(sys.argv[1:]):
-    for dirpath, dirnames, filenames in os.walk(path):
-        images |= {(fn, i, dirpath) for fn in filenames if fnre.match(fn) is not None}
-
-# The priority (i) in the tuple should cause higher-priority files with the
-# same name to sort first
-images = sorted(images)
-
-# Identify filenames which appear more than once; save the other data for these
-dupes = defaultdict(set)
-for i in range(1, len(images)):
-    if images[i - 1][0] == images[i][0]:
-        dupes[images[i][0]] |= {images[i - 1][1:], images[i][1:]}
-
-# Full paths of files which are duplicates, but NOT originals
-duplicates = []
-of = open("duplicates.txt", "w")
-
-fail = False  # Flag for a condition we can't handle
-for bn, dirs in dupes.items():  # Iterate over duplicated filenames
-    details = dict()
-    for dir in dirs:  # Iterate over instances of the filename *bn*
-        fn = os.path.join(dir[1], bn)
-        # ImageMagick hash and EXIF data
-        cmd = ["identify", "-quiet", "-format", "%#\n%[exif:*]", fn]
-        hash, _, exif = check_output(cmd).decode().partition("\n")
-        # Other file information. Inode number is not currently used, but could
-        # be used to check for hardlinks to the same inode.
-        stat = os.stat(fn, follow_symlinks=False)
-        details[fn] = (dir[0], hash, exif, int(stat.st_mtime), stat.st_ino)
-    # Pairwise compare duplicates. In a group of >2 duplicates, the highest-
-    # priority fill will 'win' all the comparisons it appears in, and will not
-    # be added to *duplicates*
-    for f1, f2 in combinations(details.items(), 2):
-        skip = False
-        if f1[1][1] == f2[1][1]:  # Compare hashes
-            if f1[1][0] > f2[1][0]:  # Compare priorities
-                f1, f2 = f2, f1  # Swap so that *f1* is higher priority
-                if f1[1][3] < f2[1][3]:
-                    fail = "File with greater priority has older mtime."
-            elif f1[1][0] == f2[1][0]:
-                skip = (
-                    "Files have matching priority, unable to determine "
-                    "which is the duplicate; skipping."
-                )
-            # commented: don't care about this for the moment
-            # # Compute a diff between the EXIF data of the two images
-            # diff = unified_diff(f1[1][2].split('\n'), f2[1][2].split('\n'),
-            #                    lineterm='')
-            # Display verbose output
-            print(
-                (
-                    "Matching hash: {0[1][1]}\n"
-                    "\t{0[1][0]} {0[1][3]} {0[0]}\n"
-                    "\t{1[1][0]} {1[1][3]} {1[0]}\n"
-                    "{2}"
-                ).format(
-                    f1,
-                    f2,
-                    ""
-                    # commented: output the EXIF diff
-                    # '\n'.join(diff)
-                ),
-                flush=True,
+from shutil import which
+import sqlite3
+from subprocess import CalledProcessError, check_output
+from tempfile import TemporaryFile
+
+import click
+from xdg_base_dirs import xdg_cache_home
+
+# Default image file extensions
+EXTENSIONS = ("jpg",)
+
+# Width and height of the grayscale thumbnails used for perceptual hashes. dHash uses
+# one extra column, for HASH_SIZE × HASH_SIZE bits.
+HASH_SIZE = 8
+
+# Default location of the hash cache
+CACHE = xdg_cache_home().joinpath("khaeru", "imgdupe.sqlite")
+
+
+def image_re(extensions):
+    """Return a regular expression matching file names with any of `extensions`."""
+    return re.compile(
+        r"^.*\.({})$".format("|".join(map(re.escape, extensions))),
+        flags=re.IGNORECASE,
+    )
+
+
+def read_rules(file):
+    """Return a list of glob patterns from the priority rules in `file`."""
+    lines = (line.strip() for line in file)
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def priority(rules, dirpath, index):
+    """Return the priority of `dirpath`, found in the `index`-th of DIRS.
+
+    Lower numbers are higher priority. If `dirpath` matches none of the `rules`, the
+    priority is `index`, after all the rules.
+    """
+    for i, rule in enumerate(rules):
+        if fnmatch(dirpath, rule):
+            return i
+    return len(rules) + index
+
+
+def scan_dir(path, index):
+    """Return `path`, `index`, file names, and subdirectory paths in `path`.
+
+    Symbolic links to directories are not followed. Unreadable directories are
+    treated as empty.
+    """
+    filenames, subdirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    filenames.append(entry.name)
+    except OSError:
+        pass
+    return path, index, filenames, subdirs
+
+
+def iter_images(dirs, pattern, rules=(), threads=None):
+    """Yield (filename, priority, dirpath) for images in `dirs`.
+
+    Each directory is scanned by one of a pool of `threads`, so images are yielded in
+    no particular order. File names must match `pattern`; see :func:`priority` for
+    `rules`.
+    """
+    with ThreadPoolExecutor(threads) as pool:
+        pending = {pool.submit(scan_dir, path, i) for i, path in enumerate(dirs)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dirpath, index, filenames, subdirs = future.result()
+                pending |= {pool.submit(scan_dir, path, index) for path in subdirs}
+
+                p = priority(rules, dirpath, index)
+                for fn in filenames:
+                    if pattern.match(fn):
+                        yield fn, p, dirpath
+
+
+def _read_run(file):
+    """Yield the items pickled to `file` by :func:`external_sort`."""
+    file.seek(0)
+    while True:
+        try:
+            yield pickle.load(file)
+        except EOFError:
+            return
+
+
+def external_sort(items, spill=1000000):
+    """Yield `items` in sorted order.
+
+    Sorted runs of `spill` items are kept in temporary files, so at most `spill` items
+    are held in memory.
+    """
+    runs = []
+    while True:
+        chunk = sorted(islice(items, spill))
+        if not runs and len(chunk) < spill:
+            # Everything fits in memory
+            yield from chunk
+            return
+        elif not chunk:
+            break
+
+        runs.append(TemporaryFile())
+        for item in chunk:
+            pickle.dump(item, runs[-1], protocol=pickle.HIGHEST_PROTOCOL)
+
+    try:
+        yield from merge(*map(_read_run, runs))
+    finally:
+        for run in runs:
+            run.close()
+
+
+def identify(path):
+    """Return the ImageMagick SHA-256 hash of the image data in `path`, and its EXIF."""
+    cmd = ["identify", "-quiet", "-format", "%#\n%[exif:*]", path]
+    hash, _, exif = check_output(cmd).decode().partition("\n")
+    return hash, exif
+
+
+def thumbnail(path, width, height):
+    """Return the grayscale pixels of `path`, resized to `width` × `height`."""
+    cmd = ["convert", "-quiet", path, "-colorspace", "Gray"]
+    cmd += ["-resize", "%dx%d!" % (width, height), "-depth", "8", "gray:-"]
+    return check_output(cmd)
+
+
+def read_imagemagick(path, perceptual):
+    """Return the hash, EXIF and (optionally) thumbnail of `path`, using ImageMagick.
+
+    If `perceptual` is :obj:`False`, the thumbnail is :obj:`None`.
+    """
+    hash, exif = identify(path)
+    pixels = thumbnail(path, HASH_SIZE + 1, HASH_SIZE) if perceptual else None
+    return hash, exif, pixels
+
+
+def read_pillow(path, perceptual):
+    """Same as :func:`read_imagemagick`, but using Pillow in the current process.
+
+    The hash is the SHA-256 of the image mode, size, and decoded pixel buffer.
+    """
+    from PIL import ExifTags, Image
+
+    with Image.open(path) as im:
+        im.load()
+        h = sha256("{} {}x{}\n".format(im.mode, im.width, im.height).encode())
+        h.update(im.tobytes())
+
+        exif = "\n".join(
+            "exif:{}={}".format(ExifTags.TAGS.get(k, k), v)
+            for k, v in im.getexif().items()
+        )
+
+        pixels = None
+        if perceptual:
+            size = (HASH_SIZE + 1, HASH_SIZE)
+            pixels = im.convert("L").resize(size, Image.Resampling.BILINEAR).tobytes()
+
+    return h.hexdigest(), exif, pixels
+
+
+BACKENDS = {"imagemagick": read_imagemagick, "pillow": read_pillow}
+
+
+def default_backend():
+    """Return "pillow" if it is installed, else "imagemagick"."""
+    return "pillow" if find_spec("PIL") else "imagemagick"
+
+
+def ahash(pixels):
+    """Average hash: 1 bit per pixel, set if the pixel is brighter than the mean."""
+    mean = sum(pixels) / len(pixels)
+    return sum(1 << i for i, p in enumerate(pixels) if p > mean)
+
+
+def dhash(pixels, width):
+    """Difference hash: 1 bit per pair of horizontally adjacent `pixels`.
+
+    The bit is set if the left pixel is brighter than the right one.
+    """
+    result = 0
+    for start in range(0, len(pixels), width):
+        end = start + width
+        row = pixels[start:end]
+        for a, b in zip(row, row[1:]):
+            result = (result << 1) | (a > b)
+    return result
+
+
+def distance(a, b):
+    """Hamming distance between integer hashes `a` and `b`."""
+    return bin(a ^ b).count("1")
+
+
+def image_info(args):
+    """Return `path` and a dict of information about the image in it.
+
+    The dict has keys "hash", "exif", "mtime", "inode", "size", "mtime_ns" and, if
+    `perceptual` is :obj:`True`, "ahash" and "dhash". The image is read using
+    `backend`, a key of :data:`BACKENDS`. :obj:`None` is returned instead of the dict
+    if the image cannot be read.
+    """
+    path, perceptual, backend = args
+    try:
+        hash, exif, pixels = BACKENDS[backend](path, perceptual)
+    except (CalledProcessError, OSError):
+        return path, None
+
+    info = dict(hash=hash, exif=exif)
+    if perceptual:
+        info.update(ahash=ahash(pixels), dhash=dhash(pixels, HASH_SIZE + 1))
+
+    # Other file information
+    stat = os.stat(path, follow_symlinks=False)
+    info.update(
+        mtime=int(stat.st_mtime),
+        inode=stat.st_ino,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+    )
+    return path, info
+
+
+class HashCache:
+    """On-disk SQLite cache of :func:`image_info`.
+
+    Entries are keyed by absolute path and backend, and are invalid if the size,
+    modification time or inode of the file differ from those recorded.
+    """
+
+    def __init__(self, path, backend):
+        self.backend = backend
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        # Perceptual hashes are stored as hexadecimal text; they may exceed 64 bits
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images (path TEXT, backend TEXT, size INTEGER, "
+            "mtime_ns INTEGER, inode INTEGER, hash TEXT, exif TEXT, ahash TEXT, "
+            "dhash TEXT, PRIMARY KEY (path, backend))"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.db.commit()
+        self.db.close()
+
+    def get(self, path, perceptual=False):
+        """Return cached information for `path`, or :obj:`None` if it is invalid."""
+        row = self.db.execute(
+            "SELECT size, mtime_ns, inode, hash, exif, ahash, dhash FROM images "
+            "WHERE path = ? AND backend = ?",
+            (os.path.abspath(path), self.backend),
+        ).fetchone()
+        if row is None or (perceptual and row[5] is None):
+            return None
+
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns, stat.st_ino) != row[:3]:
+            return None
+
+        info = dict(
+            hash=row[3],
+            exif=row[4],
+            mtime=int(stat.st_mtime),
+            inode=stat.st_ino,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+        if row[5] is not None:
+            info.update(ahash=int(row[5], 16), dhash=int(row[6], 16))
+        return info
+
+    def put(self, path, info):
+        """Store `info` from :func:`image_info` for `path`."""
+        ahash, dhash = (
+            None if info.get(k) is None else "%x" % info[k] for k in ("ahash", "dhash")
+        )
+        self.db.execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(path),
+                self.backend,
+                info["size"],
+                info["mtime_ns"],
+                info["inode"],
+                info["hash"],
+                info["exif"],
+                ahash,
+                dhash,
+            ),
+        )
+
+
+class BKTree:
+    """Burkhard–Keller tree of integer hashes, searchable by Hamming distance.
+
+    Each node is a tuple of (hash, list of items, dict of children by distance).
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, hash, item):
+        if self.root is None:
+            self.root = (hash, [item], {})
+            return
+
+        node = self.root
+        while True:
+            d = distance(hash, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            elif d not in node[2]:
+                node[2][d] = (hash, [item], {})
+                return
+            node = node[2][d]
+
+    def search(self, hash, radius):
+        """Return a list of (distance, item) for items within `radius` of `hash`."""
+        result = []
+        stack = [self.root] if self.root else []
+        while stack:
+            h, items, children = stack.pop()
+            d = distance(hash, h)
+            if d <= radius:
+                result.extend((d, item) for item in items)
+            # Only subtrees at these distances can contain matches
+            stack.extend(
+                c for k, c in children.items() if d - radius <= k <= d + radius
             )
-            assert not fail, fail  # Some condition we don't know how to handle
-            if skip:  # Don't do anything about this comparison
-                print(skip)
-                continue
-            else:  # Add f2 to the list of duplicates
-                duplicates.append(f2[0])
-                of.write(f2[0] + "\n")
-        else:  # Hashes don't match
+        return result
+
+
+def compare(details, of):
+    """Compare images with the same name and `details`; write duplicates to `of`.
+
+    `details` maps paths to tuples of (priority, hash, exif, mtime, inode). Files are
+    grouped by hash, and in each group the file with the highest priority (lowest
+    number) is kept; the others are written to `of`. Each group costs linear time,
+    plus sorting.
+    """
+    buckets = defaultdict(list)
+    for path, (priority, hash, _, mtime, _) in details.items():
+        buckets[hash].append((priority, mtime, path))
+
+    if len(buckets) > 1:
+        print(
+            "Matching filenames, distinct hash:\n{}".format(
+                "".join("\t{}\n".format(files[0][2]) for files in buckets.values())
+            ),
+            flush=True,
+        )
+
+    for hash, files in buckets.items():
+        if len(files) < 2:
+            continue
+
+        # Sort so that the highest-priority file is first
+        files.sort()
+
+        # Display verbose output
+        print(
+            "Matching hash: {}\n{}".format(
+                hash, "".join("\t{} {} {}\n".format(*f) for f in files)
+            ),
+            flush=True,
+        )
+
+        priority, mtime, _ = files[0]
+        if files[1][0] == priority:
             print(
-                "Matching filenames, distinct hash:\n\t{}\n\t{}\n".format(f1[0], f2[0]),
-                flush=True,
+                "Files have matching priority, unable to determine which is the "
+                "duplicate; skipping."
             )
+
+        for p, m, path in files[1:]:
+            if p == priority:  # Don't do anything about these files
+                continue
+            # Some condition we don't know how to handle
+            assert mtime >= m, "File with greater priority has older mtime."
+            # Add to the list of duplicates
+            of.write(path + "\n")
+
+
+def benchmark(paths, perceptual, N=100):
+    """Print the rate at which each installed backend reads up to `N` of `paths`."""
+    from time import perf_counter
+
+    paths = sorted(paths)[:N]
+    for backend in BACKENDS:
+        if not (find_spec("PIL") if backend == "pillow" else which("identify")):
+            continue
+        start = perf_counter()
+        for path in paths:
+            image_info((path, perceptual, backend))
+        rate = len(paths) / (perf_counter() - start)
+        print("{}: {:.1f} files/s".format(backend, rate))
+
+
+def find_similar(info, radius):
+    """Print pairs of images in `info` whose perceptual hashes are within `radius`.
+
+    Images with the same name are not shown, since :func:`compare` handles them.
+    Renamed copies with identical image data are shown as such.
+    """
+    tree = BKTree()
+    for path, i in info.items():
+        for d, other in tree.search(i["dhash"], radius):
+            if os.path.basename(other) == os.path.basename(path):
+                continue
+            elif info[other]["hash"] == i["hash"]:
+                title = "Identical image data"
+            else:
+                a = distance(i["ahash"], info[other]["ahash"])
+                title = "Similar appearance (dHash distance {}, aHash distance {})"
+                title = title.format(d, a)
+            print("{}:\n\t{}\n\t{}\n".format(title, other, path), flush=True)
+        tree.add(i["dhash"], path)
+
+
+def process(groups, info, perceptual, backend, cache, pool, of):
+    """Read the images in `groups` and write duplicates among them to `of`.
+
+    `groups` is a list of lists of (path, priority) for images with the same name.
+    Hashes are read from `cache` or, if not cached, in `pool`. If `perceptual` is
+    :obj:`True`, information for all images is also stored in `info`. Returns the
+    numbers of images and of those that were cached.
+    """
+    # Use cached information where it is still valid
+    batch = {path: cache.get(path, perceptual) for g in groups for path, _ in g}
+    todo = [path for path, i in batch.items() if i is None]
+
+    args = [(path, perceptual, backend) for path in todo]
+    for path, i in pool.map(image_info, args, chunksize=16):
+        batch[path] = i
+        if i is not None:
+            cache.put(path, i)
+    cache.db.commit()
+
+    for g in filter(lambda g: len(g) > 1, groups):
+        details = dict()
+        for fn, p in g:  # Iterate over instances of the filename
+            i = batch[fn]
+            if i is None:
+                print("Unable to read {}; skipping.".format(fn))
+                continue
+            details[fn] = (p, i["hash"], i["exif"], i["mtime"], i["inode"])
+        compare(details, of)
+    of.flush()
+
+    if perceptual:
+        keys = ("hash", "ahash", "dhash")
+        info.update((path, {k: i[k] for k in keys}) for path, i in batch.items() if i)
+
+    return len(batch), len(batch) - len(todo)
+
+
+@click.command(help=__doc__)
+@click.argument(
+    "dirs", nargs=-1, required=True, type=click.Path(exists=True, file_okay=False)
+)
+@click.option(
+    "-e",
+    "--ext",
+    "extensions",
+    multiple=True,
+    default=EXTENSIONS,
+    show_default=True,
+    help="Extension of image files, e.g. png, heic or cr2. May be repeated.",
+)
+@click.option(
+    "--priority",
+    "rules",
+    type=click.File(),
+    metavar="RULES",
+    help="File of glob patterns giving the priority of directories.",
+)
+@click.option(
+    "--similar",
+    "radius",
+    type=int,
+    metavar="RADIUS",
+    help="Also show images, regardless of name, with dHash within RADIUS bits.",
+)
+@click.option("-j", "--processes", type=int, help="Number of processes.")
+@click.option("--threads", type=int, help="Number of threads for scanning DIRS.")
+@click.option(
+    "--cache",
+    "cache_path",
+    type=click.Path(dir_okay=False),
+    default=str(CACHE),
+    show_default=True,
+    help="Cache of image hashes.",
+)
+@click.option("--no-cache", is_flag=True, help="Don't read or write CACHE.")
+@click.option(
+    "--backend",
+    type=click.Choice(list(BACKENDS)),
+    help="Library for reading images; default Pillow, if installed.",
+)
+@click.option(
+    "--batch",
+    "batch_size",
+    type=int,
+    default=1000,
+    hidden=True,
+    help="Number of images to read before writing results.",
+)
+@click.option(
+    "--benchmark",
+    "run_benchmark",
+    is_flag=True,
+    hidden=True,
+    help="Time each backend on the images, then exit.",
+)
+def cli(
+    dirs,
+    extensions,
+    rules,
+    radius,
+    processes,
+    threads,
+    cache_path,
+    no_cache,
+    backend,
+    batch_size,
+    run_benchmark,
+):
+    # Locate all images in the named directories
+    rules = read_rules(rules) if rules else []
+    images = iter_images(dirs, image_re(extensions), rules, threads)
+
+    perceptual = radius is not None
+    if run_benchmark:
+        paths = [os.path.join(dirpath, fn) for fn, _, dirpath in islice(images, 1000)]
+        benchmark(paths, perceptual)
+        return
+
+    # Group images by filename. Only those with duplicated names are read, unless
+    # comparing all
+    groups = (
+        [(os.path.join(dirpath, fn), p) for fn, p, dirpath in g]
+        for _, g in groupby(external_sort(images), itemgetter(0))
+    )
+    if not perceptual:
+        groups = filter(lambda g: len(g) > 1, groups)
+
+    backend = backend or default_backend()
+    info = {}
+    total = cached = 0
+    cache = HashCache(":memory:" if no_cache else cache_path, backend)
+    pool = ProcessPoolExecutor(processes)
+
+    # Full paths of files which are duplicates, but NOT originals
+    with cache, pool, open("duplicates.txt", "w") as of:
+        # Process groups in batches of roughly `batch_size` images, so that memory use
+        # does not grow with the number of images
+        batch, size = [], 0
+        for g in groups:
+            batch.append(g)
+            size += len(g)
+            if size < batch_size:
+                continue
+            n, c = process(batch, info, perceptual, backend, cache, pool, of)
+            total, cached, batch, size = total + n, cached + c, [], 0
+        n, c = process(batch, info, perceptual, backend, cache, pool, of)
+        print("{} images; {} cached".format(total + n, cached + c))
+
+    if perceptual:
+        find_similar(info, radius)
+
+
+if __name__ == "__main__":
+    cli()
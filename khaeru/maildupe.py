@@ -1,67 +1,254 @@
-"""Tool for choosing duplicate files to save from a Maildir mailbox
+"""Choose duplicate files to remove from a Maildir mailbox.
 
-OfflineIMAP, if used badly (as I do) can create duplicates of many messges.
-Used with the tool fdupes, this script can produce a list of messages that
-can be deleted.
+OfflineIMAP, if used badly (as I do) can create duplicates of many messages. These
+may differ in their headers (e.g. X-OfflineIMAP) or flags, so are not found by
+tools that compare whole files.
 
-Usage:
-  fdupes -r1n .local/share/offlineimap/Maildir/INBOX | egrep -v "(cmeta|ibex)"\
-    >dupes.txt
-  python dupes.py >remove.txt
-  cat remove.txt | xargs rm
+\b
+To find duplicates directly, use:
+$ maildupe scan ~/.local/share/offlineimap/Maildir >remove.txt
 
-Piping directly to 'xargs rm' is probably dumb. The program throws an exception
-if it fails to save exactly one file from a set of duplicates.
+Messages are duplicates if they have the same Message-ID, Date and From headers,
+and identical bodies. Only the headers are parsed; the body is hashed as it is read.
 
+\b
+Or, to choose from byte-identical duplicates found by fdupes:
+$ fdupes -r1n ~/.local/share/offlineimap/Maildir/INBOX >dupes.txt
+$ maildupe fdupes dupes.txt >remove.txt
+
+\b
+Then review remove.txt, and:
+$ cat remove.txt | xargs rm
+
+With -0, paths are separated by NUL characters instead, for "xargs -0 rm".
+
+Exactly one file is kept from each set of duplicates in the same folder: files in
+tmp/ or with incomplete names are removed first, then the file with the longest
+flags is kept. Copies in different folders (e.g. Gmail's "All Mail") are reported,
+and one copy in each folder is kept.
 """
-from os.path import basename, commonprefix, dirname, reduce
+from functools import partial
+from hashlib import sha1
+from itertools import groupby
+import os
+from os.path import basename, commonprefix, dirname
+import sqlite3
 import sys
 
+import click
 
-lines = open(sys.argv[1]).readlines()
-prefix = dirname(commonprefix(lines))
-sets = [L.rstrip().replace(" %s" % prefix, "\t%s" % prefix).split("\t") for L in lines]
+# Headers used to identify messages, in lower case
+HEADERS = (b"message-id", b"date", b"from")
 
-for s in sets:
-    s = sorted(s)
 
-    #   matches in different folders
-    root = dirname(commonprefix(s))
-    if root == "./Maildir/INBOX":
-        print(s)
-        continue
+def read_message(path, chunk_size=1 << 16):
+    """Return a digest identifying the message in `path`.
 
-    # temporary files or those with incomplete names
-    for i in range(len(s)):
-        try:
-            if s[i].endswith("khaeru-laptop") or "/tmp/" in s[i]:
-                print(s.pop(i))
-                i -= 1
-        except IndexError:
-            pass
-
-    # descisions based on message flags
-    flags = [basename(f).split(",")[-1] for f in s]
-
-    if reduce(lambda a, b: a and b, map(lambda s: s == flags[0], flags)):
-        # all flags the same, delete all but one file
-        while len(s) > 1:
-            print(s.pop())
-    else:
-        # longest flag
-        for f in flags:
-            if len(f) == max(map(len, flags)):
-                flag = f
+    The digest covers the :data:`HEADERS` and the body of the message. Headers are
+    parsed line by line until the blank line that ends them; the body is hashed in
+    chunks of `chunk_size` bytes, so whole messages are never held in memory.
+    """
+    headers = {}
+    body = sha1()
+    with open(path, "rb") as f:
+        name = None
+        for line in f:
+            if line in (b"\n", b"\r\n"):
+                break  # End of headers
+            elif line[:1] in (b" ", b"\t"):
+                # Continuation of a folded header
+                if name in HEADERS and name in headers:
+                    headers[name] += b" " + line.strip()
+                continue
+
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name in HEADERS and name not in headers:
+                headers[name] = value.strip()
+            else:
+                name = None  # Ignore continuations of other or repeated headers
+
+        for chunk in iter(partial(f.read, chunk_size), b""):
+            body.update(chunk)
+
+    result = sha1()
+    for name in HEADERS:
+        result.update(headers.get(name, b"") + b"\0")
+    result.update(body.digest())
+    return result.digest()
+
+
+def iter_maildir(paths):
+    """Yield paths of messages in all Maildir folders in or under `paths`.
+
+    Only the "cur" and "new" subdirectories of each folder are read.
+    """
+    for path in paths:
+        for dirpath, dirnames, filenames in os.walk(path):
+            if "cur" not in dirnames:
                 continue
+            for subdir in ("cur", "new"):
+                if subdir not in dirnames:
+                    continue
+                with os.scandir(os.path.join(dirpath, subdir)) as entries:
+                    yield from (e.path for e in entries if e.is_file())
+            # Don't descend into the message directories
+            dirnames[:] = [d for d in dirnames if d not in ("cur", "new", "tmp")]
+
+
+def _digests(paths):
+    """Yield (digest, path) for messages in `paths`, skipping unreadable files."""
+    for path in iter_maildir(paths):
+        try:
+            yield read_message(path), path
+        except OSError:
+            click.echo("Unable to read %s; skipping." % path, err=True)
+
+
+def scan(paths):
+    """Yield lists of paths of duplicate messages in Maildir folders under `paths`.
+
+    Digests are kept in a temporary, on-disk SQLite database, so memory use does not
+    grow with the number of messages.
+    """
+    db = sqlite3.connect("")
+    db.execute("CREATE TABLE messages (digest BLOB, path TEXT)")
+    with db:
+        db.executemany("INSERT INTO messages VALUES (?, ?)", _digests(paths))
+
+    rows = db.execute(
+        "SELECT digest, path FROM messages WHERE digest IN (SELECT digest FROM "
+        "messages GROUP BY digest HAVING COUNT(*) > 1) ORDER BY digest, path"
+    )
+    for _, group in groupby(rows, lambda row: row[0]):
+        yield [row[1] for row in group]
+    db.close()
+
+
+def iter_fdupes(file):
+    """Yield lists of paths from `file`, the output of ``fdupes -1``."""
+    lines = file.readlines()
+    prefix = dirname(commonprefix(lines))
+    for line in lines:
+        # Paths are separated by single spaces, but may also contain spaces
+        yield line.rstrip().replace(" %s" % prefix, "\t%s" % prefix).split("\t")
+
+
+def flags(path):
+    """Return the Maildir flags of `path`: the text after ":2,", if any."""
+    return basename(path).partition(":2,")[2]
+
+
+def temporary(path):
+    """Return :obj:`True` if `path` is in tmp/, or its name lacks the ":2," info."""
+    return "/tmp/" in path or ":2," not in basename(path)
+
+
+def select(paths):
+    """Return the one of `paths` to keep, and a list of the others.
+
+    The survivor is chosen in a single pass. Temporary files or those with incomplete
+    names are removed first. Then the file with the longest flags is kept, with ties
+    broken by the first path in sorted order.
+    """
+    keep, keep_rank, remove = None, None, []
+    for path in paths:
+        rank = (not temporary(path), len(flags(path)))
+        if keep is None:
+            keep, keep_rank = path, rank
+        elif rank > keep_rank or (rank == keep_rank and path < keep):
+            remove.append(keep)
+            keep, keep_rank = path, rank
+        else:
+            remove.append(path)
+    return keep, remove
+
+
+def benchmark(N=1000):
+    """Return cases for timing :func:`select`; see "khaeru benchmark".
+
+    :func:`select` is compared to the selection loop it replaced. Synthetic groups of
+    `N` paths are used, with a mix of flags and temporary files.
+    """
+    from functools import reduce
+
+    def former(s):
+        s = sorted(s)
         for i in range(len(s)):
             try:
-                if not s[i].endswith(flag):
-                    print(s.pop(i))
+                if s[i].endswith("khaeru-laptop") or "/tmp/" in s[i]:
+                    s.pop(i)
                     i -= 1
             except IndexError:
                 pass
+        flags = [basename(f).split(",")[-1] for f in s]
+        if reduce(lambda a, b: a and b, map(lambda s: s == flags[0], flags)):
+            while len(s) > 1:
+                s.pop()
+        else:
+            for f in flags:
+                if len(f) == max(map(len, flags)):
+                    flag = f
+                    continue
+            for i in range(len(s)):
+                try:
+                    if not s[i].endswith(flag):
+                        s.pop(i)
+                        i -= 1
+                except IndexError:
+                    pass
+
+    groups = {
+        "same flags": [f"INBOX/cur/{i}.khaeru-laptop,U={i}:2,S" for i in range(N)],
+        "mixed flags": [
+            f"INBOX/{'tmp' if i % 10 == 0 else 'cur'}/{i}.khaeru-laptop,U={i}:2,"
+            + "FRS"[: i % 4]
+            for i in range(N)
+        ],
+    }
+    return former, select, groups
+
+
+def process(groups, end="\n"):
+    """Write the paths to delete from each of `groups`, each followed by `end`."""
+    for group in groups:
+        # Split matches by folder; copies in different folders are all kept
+        folders = {}
+        for path in group:
+            folders.setdefault(dirname(dirname(path)), []).append(path)
+        if len(folders) > 1:
+            click.echo(
+                "Matches in different folders:\n\t" + "\n\t".join(group), err=True
+            )
+
+        for paths in folders.values():
+            if len(paths) > 1:
+                _, remove = select(paths)
+                sys.stdout.write("".join(path + end for path in remove))
+
+
+@click.group(help=__doc__)
+def cli():
+    pass
+
+
+@cli.command("scan")
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, file_okay=False)
+)
+@click.option("-0", "--null", is_flag=True, help="End paths with NUL, not newline.")
+def scan_cmd(paths, null):
+    """Find duplicate messages in Maildir folders under PATHS."""
+    process(scan(paths), "\0" if null else "\n")
+
+
+@cli.command("fdupes")
+@click.argument("dupes", type=click.File())
+@click.option("-0", "--null", is_flag=True, help="End paths with NUL, not newline.")
+def fdupes_cmd(dupes, null):
+    """Choose from duplicates found by 'fdupes -1' in DUPES."""
+    process(iter_fdupes(dupes), "\0" if null else "\n")
+
 
-    # deleting too many or too few files from this set
-    if len(s) != 1:
-        print("BLARG!", s, "\n")
-        raise SystemExit(0)
+if __name__ == "__main__":
+    cli()
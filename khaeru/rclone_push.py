@@ -71,7 +71,6 @@ from subprocess import Popen, PIPE, STDOUT
 from sys import exit, stdout
 
 import click
-from git import Repo
 import yaml
 
 
@@ -80,6 +79,8 @@ def get_commit_hash():
 
     A '+' is appended if the current directory is dirty.
     """
+    from git import Repo
+
     repo = Repo(".", search_parent_directories=True)
     path = Path(".").resolve().relative_to(repo.working_dir)
     result = repo.head.commit.hexsha[:7]
@@ -6,8 +6,6 @@ from pathlib import Path
 from subprocess import check_output
 from typing import Any, Dict, Iterable, Tuple
 
-import pandas as pd
-
 # Current time zone
 LOCAL_TZ = datetime.now().astimezone().tzinfo
 NOW = datetime.now(LOCAL_TZ)
@@ -38,6 +36,8 @@ class TaskClient:
         return check_output(["task", query, "uuids"], text=True).strip().split(" ")
 
     def export(self, query=["estimate.any:"]):
+        import pandas as pd
+
         # List of tasks with 'estimate' set
         cmd = ["task"] + query + ["-COMPLETED", "-DELETED", "export"]
         tw_json = check_output(cmd)
@@ -113,6 +113,8 @@ def postponed(event: Dict[str, Any]) -> timedelta:
 
 
 def read_undo_data():
+    import pandas as pd
+
     undo_data_path = (
         Path(client.show("data.location")).expanduser().joinpath("undo.data")
     )